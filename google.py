@@ -17,13 +17,20 @@ CHROME_DRIVER = Path(__file__).parent / 'chromedriver'
 CHROME_DRIVER_DOWNLOAD_PAGE = "https://sites.google.com/a/chromium.org/chromedriver/downloads"
 MAX_RETRIES = 3
 
-if not CHROME_DRIVER.exists():
-    raise FileNotFoundError(f"'chromedriver' executable not found. "
-                            f"Download it from {CHROME_DRIVER_DOWNLOAD_PAGE} "
-                            f"and place it next to this script file")
+# Text of the result metadata nodes, starting from the given offset
+RESULT_META_SCRIPT = """
+return Array.from(document.querySelectorAll('div.rg_di div.rg_meta'))
+            .slice(arguments[0])
+            .map(node => node.textContent);
+"""
 
 
 def get_driver(headless=True):
+    if not CHROME_DRIVER.exists():
+        raise FileNotFoundError(f"'chromedriver' executable not found. "
+                                f"Download it from {CHROME_DRIVER_DOWNLOAD_PAGE} "
+                                f"and place it next to this script file")
+
     options = webdriver.ChromeOptions()
 
     if headless:
@@ -55,34 +62,78 @@ def parse_urls_from_source(page_source):
     ]
 
 
+def parse_urls_from_metas(metas):
+    return [json.loads(meta)["ou"] for meta in metas]
+
+
+class ResultHarvester(object):
+    """Incrementally collect image urls from a google images result page.
+
+    Only the result nodes added since the last harvest are fetched from the
+    browser and parsed, and urls are de-duplicated as they come.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.n_nodes = 0
+        self.urls = []
+        self._seen = set()
+
+    def harvest(self):
+        """Parse newly added result nodes and return the new urls"""
+        metas = self.driver.execute_script(RESULT_META_SCRIPT, self.n_nodes)
+        self.n_nodes += len(metas)
+        new_urls = []
+        for url in parse_urls_from_metas(metas):
+            if url not in self._seen:
+                self._seen.add(url)
+                new_urls.append(url)
+        self.urls.extend(new_urls)
+        return new_urls
+
+    def stream(self, n_images, wait=1.0):
+        """Scroll down the result page and yield urls as soon as they appear.
+
+        Parameters
+        ----------
+        n_images : int
+            Number of expected images
+        wait : float
+            Base time to wait for new results after each scroll
+        """
+        yield from self.harvest()
+        previous_n = new_n = len(self.urls)
+
+        current_retries = 0
+        n_scrolls = 0
+        # Scroll down until there are enough images or unsuccessful retries exceeded maximum retries
+        while (new_n < n_images) and (current_retries < MAX_RETRIES):
+            scroll_down(
+                self.driver,
+                click_more_results=(new_n == previous_n) and (current_retries != 0)
+            )
+            n_scrolls += 1
+            print(f"Scrolled {n_scrolls} times already")
+            current_retries += 1
+            # Do incremental waits until more images appear
+            for i in range(4):
+                sleep(wait * (0.5 * i + 1))
+                yield from self.harvest()
+                new_n = len(self.urls)
+                if new_n > previous_n:
+                    current_retries = 0
+                    print(f"{new_n} images so far")
+                    break
+            previous_n = new_n
+
+        print(f"{len(self.urls)} images found.")
+
+
 def get_urls(driver, n_images):
-    urls = parse_urls_from_source(driver.page_source)
-    previous_n = new_n = len(urls)
-
-    current_retries = 0
-    n_scrolls = 0
-    # Scroll down until there are enough images or unsuccessful retries exceeded maximum retries
-    while (new_n < n_images) and (current_retries < MAX_RETRIES):
-        scroll_down(
-            driver,
-            click_more_results=(new_n == previous_n) and (current_retries != 0)
-        )
-        n_scrolls += 1
-        print(f"Scrolled {n_scrolls} times already")
-        current_retries += 1
-        # Do incremental waits until more images appear
-        for i in range(4):
-            sleep(0.5 * i + 1)
-            urls = parse_urls_from_source(driver.page_source)
-            new_n = len(urls)
-            if new_n > previous_n:
-                current_retries = 0
-                print(f"{new_n} images so far")
-                break
-        previous_n = new_n
-
-    print(f"{len(urls)} images found.")
-    return urls
+    harvester = ResultHarvester(driver)
+    for _ in harvester.stream(n_images):
+        pass
+    return harvester.urls
 
 
 def main(args):
@@ -95,12 +146,12 @@ def main(args):
     elem.send_keys(args.query)
     elem.send_keys(Keys.RETURN)
 
-    urls = get_urls(driver, args.n_images)
-
     store_path = args.store_path / 'google' / args.query.replace(" ", "_")
     print(f"Downloading to {store_path}")
+    # Urls are downloaded as they are found, while the browser keeps scrolling
+    harvester = ResultHarvester(driver)
     paths = download(
-        urls,
+        harvester.stream(args.n_images),
         store_path=store_path,
         n_workers=args.n_workers,
         timeout=args.timeout,
@@ -113,7 +164,7 @@ def main(args):
         force=args.force,
     )
 
-    return dict(zip(urls, paths))
+    return dict(zip(harvester.urls, paths))
 
 
 if __name__ == '__main__':
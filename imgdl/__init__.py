@@ -5,6 +5,6 @@
 Bulk image downloader from a list of urls
 """
 
-from .downloader import download
+from .downloader import CancelToken, ImageRejected, download
 
-__all__ = ['download']
+__all__ = ['download', 'CancelToken', 'ImageRejected']
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Disk budget management of the images stored in store_path
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+INDEX_NAME = '.imgdl-cache.sqlite'
+POLICIES = {
+    'lru': 'atime',
+    'lfu': 'hits, atime',
+}
+# Eviction frees space down to this fraction of the budget, so that it does
+# not run again on the very next download
+LOW_WATERMARK = 0.9
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    atime REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS files_atime ON files (atime);
+CREATE INDEX IF NOT EXISTS files_hits ON files (hits, atime);
+
+CREATE TABLE IF NOT EXISTS stats (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    n_files INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO stats VALUES (0, 0, 0);
+
+CREATE TRIGGER IF NOT EXISTS files_insert AFTER INSERT ON files BEGIN
+    UPDATE stats SET n_files = n_files + 1, size = size + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS files_delete AFTER DELETE ON files BEGIN
+    UPDATE stats SET n_files = n_files - 1, size = size - OLD.size;
+END;
+CREATE TRIGGER IF NOT EXISTS files_update AFTER UPDATE OF size ON files BEGIN
+    UPDATE stats SET size = size - OLD.size + NEW.size;
+END;
+"""
+
+
+class CacheIndex(object):
+    """Index of the images stored in store_path.
+
+    Size, last access time and number of hits of every image are kept on a
+    sqlite database next to the images, together with running totals. Usage
+    is then known without scanning store_path, and eviction only reads the
+    least recently (or frequently) used entries. The database is shared by
+    all the threads and processes using the same store_path.
+
+    Parameters
+    ----------
+    store_path : str
+        Root path where images are stored
+    max_size : int
+        Maximum number of bytes used by the images
+    max_files : int
+        Maximum number of images
+    policy : str
+        Eviction policy, either 'lru' (least recently used) or 'lfu'
+        (least frequently used)
+    """
+
+    def __init__(self, store_path, max_size=None, max_files=None, policy='lru'):
+        if policy not in POLICIES:
+            raise ValueError(f"policy should be one of {list(POLICIES)}")
+        self.store_path = Path(store_path).expanduser()
+        self.max_size = max_size
+        self.max_files = max_files
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._evicting = threading.Lock()
+
+        index_path = self.store_path / INDEX_NAME
+        is_new = not index_path.exists()
+        self._conn = sqlite3.connect(str(index_path), timeout=60,
+                                     isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # Commits are not synced to disk one by one. A crash may lose the
+        # last accesses, never corrupt the index
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        if is_new:
+            self.rebuild()
+
+    def rebuild(self):
+        """Synchronize the index with the images found on store_path.
+
+        This is the only operation scanning the whole directory. It is done
+        when the index is created, or on demand if images were added or
+        removed by other means than imgdl.
+        """
+        files = {}
+        for path in self.store_path.glob('*.jpg'):
+            stat = path.stat()
+            files[path.name] = (stat.st_size, stat.st_atime)
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            indexed = {name for name, in self._conn.execute('SELECT name FROM files')}
+            self._conn.executemany(
+                'DELETE FROM files WHERE name = ?',
+                [(name,) for name in indexed - set(files)]
+            )
+            self._conn.executemany(
+                'INSERT INTO files (name, size, atime) VALUES (?, ?, ?)',
+                [(name, size, atime) for name, (size, atime) in files.items()
+                 if name not in indexed]
+            )
+            self._conn.execute('COMMIT')
+
+    def sync(self):
+        """Rebuild the index if the number of images on store_path differs
+        from the indexed one.
+
+        Only the names of the directory entries are listed, which is much
+        cheaper than the full rescan of ``rebuild``. It catches images
+        written without the index, e.g. by another tool or before the index
+        existed.
+
+        Returns
+        -------
+        rebuilt : bool
+            True if the index was rebuilt
+        """
+        with os.scandir(self.store_path) as entries:
+            n_files = sum(entry.name.endswith('.jpg') for entry in entries)
+        if n_files == self.usage()[0]:
+            return False
+        self.rebuild()
+        return True
+
+    def add(self, path, tmp_path=None):
+        """Index a newly written image.
+
+        Parameters
+        ----------
+        path : str
+            Path of the image
+        tmp_path : str
+            If given, temporary file holding the image, moved to path in the
+            same transaction as the indexing. An eviction of path, which
+            also runs in a transaction, can then not remove the new image
+        """
+        path = Path(path)
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                if tmp_path is not None:
+                    os.replace(str(tmp_path), str(path))
+                size = path.stat().st_size
+                updated = self._conn.execute(
+                    'UPDATE files SET size = ?, atime = ?, hits = hits + 1 WHERE name = ?',
+                    (size, time.time(), path.name)
+                ).rowcount
+                if not updated:
+                    self._conn.execute(
+                        'INSERT INTO files (name, size, atime, hits) VALUES (?, ?, ?, 1)',
+                        (path.name, size, time.time())
+                    )
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def touch(self, path):
+        """Record a cache hit on an image.
+
+        Returns
+        -------
+        hit : bool
+            False if the image is not indexed, because it is being evicted or
+            was not written through the index. It should then be downloaded
+            again rather than used
+        """
+        with self._lock:
+            updated = self._conn.execute(
+                'UPDATE files SET atime = ?, hits = hits + 1 WHERE name = ?',
+                (time.time(), Path(path).name)
+            ).rowcount
+        return bool(updated)
+
+    def usage(self):
+        """Number of images and bytes used on store_path"""
+        with self._lock:
+            return self._conn.execute('SELECT n_files, size FROM stats').fetchone()
+
+    def over_budget(self, max_size=None, max_files=None):
+        max_size = max_size or self.max_size
+        max_files = max_files or self.max_files
+        n_files, size = self.usage()
+        return ((max_size is not None and size > max_size) or
+                (max_files is not None and n_files > max_files))
+
+    def evict(self, max_size=None, max_files=None, batch=1000):
+        """Remove least recently (or frequently) used images until the
+        budget is met.
+
+        Images are removed by small batches. An image accessed by a download
+        after being selected for eviction is spared. The index entry and the
+        file of an image are removed in one transaction, so that no image is
+        written and indexed in between.
+
+        Parameters
+        ----------
+        max_size : int
+            Maximum number of bytes used by the images. Defaults to the
+            budget of the index
+        max_files : int
+            Maximum number of images. Defaults to the budget of the index
+        batch : int
+            Number of candidates read from the index at once
+
+        Returns
+        -------
+        n_removed, freed : int, int
+            Number of images removed and number of bytes freed
+        """
+        max_size = max_size or self.max_size
+        max_files = max_files or self.max_files
+        target_size = max_size and int(max_size * LOW_WATERMARK)
+        target_files = max_files and int(max_files * LOW_WATERMARK)
+        order = POLICIES[self.policy]
+
+        n_removed = freed = 0
+        while True:
+            n_files, size = self.usage()
+            excess_size = size - target_size if target_size is not None else 0
+            excess_files = n_files - target_files if target_files is not None else 0
+            if excess_size <= 0 and excess_files <= 0:
+                break
+            with self._lock:
+                candidates = self._conn.execute(
+                    f'SELECT name, size, atime FROM files ORDER BY {order} LIMIT ?',
+                    (batch,)
+                ).fetchall()
+            if not candidates:
+                break
+            for name, file_size, atime in candidates:
+                if excess_size <= 0 and excess_files <= 0:
+                    break
+                with self._lock:
+                    self._conn.execute('BEGIN IMMEDIATE')
+                    try:
+                        deleted = self._conn.execute(
+                            'DELETE FROM files WHERE name = ? AND atime = ?', (name, atime)
+                        ).rowcount
+                        if deleted:
+                            try:
+                                Path(self.store_path, name).unlink()
+                            except FileNotFoundError:
+                                pass
+                    except BaseException:
+                        self._conn.execute('ROLLBACK')
+                        raise
+                    self._conn.execute('COMMIT')
+                if not deleted:
+                    continue
+                n_removed += 1
+                freed += file_size
+                excess_size -= file_size
+                excess_files -= 1
+        return n_removed, freed
+
+    def maybe_evict(self):
+        """Evict images if the budget is exceeded and no other thread is
+        already doing it"""
+        if not self.over_budget():
+            return 0, 0
+        if not self._evicting.acquire(blocking=False):
+            return 0, 0
+        try:
+            return self.evict()
+        finally:
+            self._evicting.release()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -6,24 +6,25 @@ CLI for image downloader
 """
 
 import argparse
+import sys
+from contextlib import ExitStack
 from pathlib import Path
 
 from . import download
+from .cache import POLICIES, CacheIndex
+from .server import serve
 from .settings import config
+from .tracing import SamplingProfiler
+from .transport import TRANSPORTS
+from .utils import parse_size
 
 __author__ = "Felipe Aguirre Martinez"
 __copyright__ = "Copyright 2017, Workit software"
 __email__ = "faguirre@workit-software.com"
 
 
-def parse(args=None):
-    parser = argparse.ArgumentParser(
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-        description="Bulk image downloader from a list of urls"
-    )
-
-    parser.add_argument('urls', type=str,
-                        help="Text file with the list of urls to be downloaded")
+def add_downloader_arguments(parser):
+    """Add the arguments given to ``ImageDownloader`` to the parser"""
 
     parser.add_argument('-o', '--store_path', type=str, default=config['STORE_PATH'],
                         help="Root path where images should be stored")
@@ -40,31 +41,118 @@ def parse(args=None):
     parser.add_argument('--max_wait', type=float, default=config['MAX_WAIT'],
                         help="Maximum wait time between image downloads")
 
+    parser.add_argument('--max_time', type=float, default=config['MAX_TIME'],
+                        help="Total time budget of each url, beyond the request timeout")
+
     parser.add_argument('--proxy', type=str, action='append', default=config['PROXIES'],
                         help="Proxy or list of proxies to use for the requests")
 
     parser.add_argument('-u', '--user_agent', type=str, default=config['USER_AGENT'],
                         help="User agent to be used for the requests")
 
+    parser.add_argument('--transport', type=str, choices=TRANSPORTS, default=config['TRANSPORT'],
+                        help="HTTP transport. http2 multiplexes downloads from a same "
+                             "host over a few connections and requires imgdl[http2]")
+
+    parser.add_argument('-d', '--debug', action='store_true',
+                        help="Activate debug mode")
+
+    parser.add_argument('--min_size', type=int, default=config['MIN_SIZE'],
+                        help="Minimum width and height of the images to keep")
+
+    parser.add_argument('--max_pixels', type=int, default=config['MAX_PIXELS'],
+                        help="Maximum number of pixels of the images to keep")
+
+    parser.add_argument('--aspect_ratio', type=float, nargs=2, default=config['ASPECT_RATIO'],
+                        metavar=('MIN', 'MAX'),
+                        help="Range of width / height ratio of the images to keep")
+
+    parser.add_argument('--format', type=str, action='append', default=config['FORMATS'],
+                        help="Image format to keep (e.g. JPEG, PNG). Can be specified "
+                             "as many times as formats you want")
+
+    parser.add_argument('--cache_max_size', type=str, default=config['CACHE_MAX_SIZE'],
+                        help="Disk budget of store_path (e.g. 500G). Least used "
+                             "images are evicted when it is exceeded")
+
+    parser.add_argument('--cache_max_files', type=int, default=config['CACHE_MAX_FILES'],
+                        help="Maximum number of images kept on store_path")
+
+    parser.add_argument('--cache_policy', type=str, choices=POLICIES, default=config['CACHE_POLICY'],
+                        help="Eviction policy: least recently or least frequently used")
+
+    return parser
+
+
+def parse(args=None):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="Bulk image downloader from a list of urls. "
+                    "Use 'imgdl serve --help' to run it as a daemon, and "
+                    "'imgdl gc --help' to free space on store_path."
+    )
+
+    parser.add_argument('urls', type=str,
+                        help="Text file with the list of urls to be downloaded")
+
+    add_downloader_arguments(parser)
+
     parser.add_argument('-f', '--force', action='store_true',
                         help="Force the download even if the files already exists")
 
     parser.add_argument('--notebook', action='store_true',
                         help="Use the notebook version of tqdm")
 
-    parser.add_argument('-d', '--debug', action='store_true',
-                        help="Activate debug mode")
+    parser.add_argument('--deadline', type=float, default=None,
+                        help="Number of seconds after which the download is stopped. "
+                             "Images downloaded so far are kept")
+
+    parser.add_argument('--rejected', type=str, default=None,
+                        help="Write the rejected urls to this file, one per line followed "
+                             "by the reason of their rejection, tab separated")
+
+    parser.add_argument('--trace', type=str, default=None,
+                        help="Write the timeline of each url to this file, as Chrome trace "
+                             "event JSON (open it with chrome://tracing or Perfetto)")
+
+    parser.add_argument('--profile', type=str, default=None,
+                        help="Sample the imgdl stacks of every thread during the run and "
+                             "write them to this file as collapsed stacks (flamegraph)")
 
     args = parser.parse_args(args)
 
     return args
 
 
-def main(args=None):
-    args = parse(args)
-    urls = Path(args.urls).read_text().strip().split()
-    _ = download(
-        urls,
+def parse_serve(args=None):
+    parser = argparse.ArgumentParser(
+        prog='imgdl serve',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="Run imgdl as a daemon accepting batch download jobs on a local HTTP API"
+    )
+
+    parser.add_argument('--host', type=str, default=config['SERVER_HOST'],
+                        help="Interface to bind the server to")
+
+    parser.add_argument('-p', '--port', type=int, default=config['SERVER_PORT'],
+                        help="Port to listen to")
+
+    parser.add_argument('--max_per_host', type=int, default=config['MAX_PER_HOST'],
+                        help="Maximum number of simultaneous downloads on a same host")
+
+    add_downloader_arguments(parser)
+
+    args = parser.parse_args(args)
+
+    return args
+
+
+def serve_main(args=None):
+    args = parse_serve(args)
+    serve(
+        host=args.host,
+        port=args.port,
+        max_per_host=args.max_per_host,
         store_path=args.store_path,
         n_workers=args.n_workers,
         timeout=args.timeout,
@@ -72,7 +160,113 @@ def main(args=None):
         max_wait=args.max_wait,
         proxies=args.proxy,
         user_agent=args.user_agent,
-        notebook=args.notebook,
         debug=args.debug,
-        force=args.force,
+        min_size=args.min_size,
+        max_pixels=args.max_pixels,
+        aspect_ratio=args.aspect_ratio,
+        formats=args.format,
+        cache_max_size=args.cache_max_size,
+        cache_max_files=args.cache_max_files,
+        cache_policy=args.cache_policy,
+        max_time=args.max_time,
+        transport=args.transport,
+    )
+
+
+def parse_gc(args=None):
+    parser = argparse.ArgumentParser(
+        prog='imgdl gc',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="Evict least used images from store_path until it fits in the budget"
     )
+
+    parser.add_argument('-o', '--store_path', type=str, default=config['STORE_PATH'],
+                        help="Root path where images are stored")
+
+    parser.add_argument('--max_size', '--max-size', type=str, default=config['CACHE_MAX_SIZE'],
+                        help="Disk budget of store_path (e.g. 500G)")
+
+    parser.add_argument('--max_files', '--max-files', type=int, default=config['CACHE_MAX_FILES'],
+                        help="Maximum number of images kept on store_path")
+
+    parser.add_argument('--policy', type=str, choices=POLICIES, default=config['CACHE_POLICY'],
+                        help="Eviction policy: least recently or least frequently used")
+
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Rescan store_path to synchronize the cache index with "
+                             "images added or removed by hand. By default, it is only "
+                             "rescanned when its number of images differs from the index")
+
+    args = parser.parse_args(args)
+    if args.max_size is None and args.max_files is None:
+        parser.error("one of --max_size or --max_files is required")
+
+    return args
+
+
+def gc_main(args=None):
+    args = parse_gc(args)
+    cache = CacheIndex(
+        args.store_path,
+        max_size=args.max_size and parse_size(args.max_size),
+        max_files=args.max_files,
+        policy=args.policy,
+    )
+    if args.rebuild:
+        cache.rebuild()
+    else:
+        cache.sync()
+    n_removed, freed = cache.evict()
+    n_files, size = cache.usage()
+    cache.close()
+    print(f"Removed {n_removed} images ({freed / 1024 ** 2:.1f} MiB), "
+          f"{n_files} images ({size / 1024 ** 2:.1f} MiB) left on {args.store_path}")
+
+
+COMMANDS = {
+    'serve': serve_main,
+    'gc': gc_main,
+}
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else list(args)
+    if args and args[0] in COMMANDS:
+        return COMMANDS[args[0]](args[1:])
+    args = parse(args)
+    urls = Path(args.urls).read_text().strip().split()
+    with ExitStack() as stack:
+        profiler = stack.enter_context(SamplingProfiler()) if args.profile else None
+        paths = download(
+            urls,
+            store_path=args.store_path,
+            n_workers=args.n_workers,
+            timeout=args.timeout,
+            min_wait=args.min_wait,
+            max_wait=args.max_wait,
+            proxies=args.proxy,
+            user_agent=args.user_agent,
+            notebook=args.notebook,
+            debug=args.debug,
+            force=args.force,
+            deadline=args.deadline,
+            min_size=args.min_size,
+            max_pixels=args.max_pixels,
+            aspect_ratio=args.aspect_ratio,
+            formats=args.format,
+            cache_max_size=args.cache_max_size,
+            cache_max_files=args.cache_max_files,
+            cache_policy=args.cache_policy,
+            max_time=args.max_time,
+            transport=args.transport,
+            trace=args.trace,
+        )
+
+    if args.rejected is not None:
+        Path(args.rejected).write_text(''.join(
+            f"{url}\t{reason}\n" for url, reason in paths.rejected.items()
+        ))
+
+    if profiler is not None:
+        profiler.dump(args.profile)
+        print(profiler.report())
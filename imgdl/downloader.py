@@ -1,35 +1,143 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import collections
+import collections.abc
 import hashlib
+import heapq
 import logging
 import random
+import threading
 from concurrent import futures
 from io import BytesIO
 from pathlib import Path
 from pprint import pformat
-from time import sleep
+from time import monotonic, sleep
 from uuid import uuid4
 
 import attr
-import requests
 from PIL import Image
 from tqdm import tqdm, tqdm_notebook
 
+from .cache import INDEX_NAME, CacheIndex
 from .settings import config, get_logger
-from .utils import to_bytes
+from .tracing import NullTracer, Tracer
+from .transport import HTTP2_AVAILABLE, TRANSPORTS, RequestsTransport, make_session  # noqa: F401
+from .utils import parse_size, to_bytes, to_size
 
+CHUNK_SIZE = 16 * 1024
+# Image headers are looked for in the first bytes of the response only
+HEADER_MAX_BYTES = 256 * 1024
 
-def make_session(proxies=None, headers=None):
-    proxies = proxies or {}
-    headers = headers or {}
-    s = requests.Session()
-    s.proxies.update(proxies)
-    s.headers.update(headers)
-    s.id = uuid4().hex
 
-    return s
+class ImageRejected(Exception):
+    """Image discarded by the filters of the downloader"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Cancelled(Exception):
+    """Download interrupted by the cancellation of its batch"""
+
+
+class CancelToken(object):
+    """Handle to cancel a batch download from another thread.
+
+    Once cancelled, no new url is scheduled and in-flight downloads are
+    aborted between two chunks of their response.
+
+    Parameters
+    ----------
+    deadline : float
+        Number of seconds after which the batch is cancelled
+    parent : CancelToken
+        If given, the token is also cancelled with its parent, which is
+        left untouched by the deadline and cancellation of the token
+    """
+
+    def __init__(self, deadline=None, parent=None):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.parent = parent
+        self.expires = None
+        if deadline is not None:
+            self.set_deadline(deadline)
+        if parent is not None:
+            parent.add_callback(self.cancel)
+
+    def set_deadline(self, deadline):
+        """Cancel the batch in ``deadline`` seconds, unless it already
+        expires sooner"""
+        expires = monotonic() + deadline
+        if self.expires is None or expires < self.expires:
+            self.expires = expires
+
+    def add_callback(self, callback):
+        """Call callback, without arguments, when ``cancel`` is called. It is
+        called at once if the token was already cancelled this way"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def close(self):
+        """Stop following the parent token"""
+        if self.parent is not None:
+            self.parent.remove_callback(self.cancel)
+
+    def cancel(self):
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    @property
+    def cancelled(self):
+        return (self._event.is_set() or
+                (self.expires is not None and monotonic() >= self.expires) or
+                (self.parent is not None and self.parent.cancelled))
+
+    def remaining(self):
+        """Seconds left before the deadline, or None if there is none"""
+        remaining = []
+        if self.expires is not None:
+            remaining.append(max(0.0, self.expires - monotonic()))
+        if self.parent is not None and self.parent.remaining() is not None:
+            remaining.append(self.parent.remaining())
+        return min(remaining) if remaining else None
+
+    def wait(self, seconds):
+        """Sleep for the given seconds, waking up early on cancellation"""
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, remaining)
+        self._event.wait(seconds)
+
+
+class Paths(list):
+    """Paths of a batch download, as returned by ``ImageDownloader``.
+
+    None is given instead of the path of the images that failed, were
+    rejected or were cancelled.
+
+    Attributes
+    ----------
+    rejected : dict
+        Reason of the rejection of each rejected url
+    """
+
+    def __init__(self, paths=(), rejected=None):
+        super().__init__(paths)
+        self.rejected = rejected or {}
 
 
 @attr.s
@@ -62,6 +170,33 @@ class ImageDownloader(object):
         If True, log urls that could not be downloaded
     logfile : str
         Path to logfile
+    min_size : int | tuple
+        Minimum (width, height) of the images to keep. An int applies to
+        both dimensions
+    max_pixels : int
+        Maximum number of pixels of the images to keep. Protects workers
+        against decompression bombs. It replaces the limit of Pillow, whose
+        ``Image.MAX_IMAGE_PIXELS`` is turned off for the whole process
+    aspect_ratio : tuple
+        (min, max) width / height ratio of the images to keep
+    formats : list
+        Image formats to keep, as named by Pillow (e.g. JPEG, PNG, GIF)
+    cache_max_size : int | str
+        Disk budget of store_path, in bytes or as a human readable size
+        like '500G'. Least used images are evicted when it is exceeded
+    cache_max_files : int
+        Maximum number of images kept on store_path
+    cache_policy : str
+        Eviction policy, either 'lru' (least recently used) or 'lfu'
+        (least frequently used)
+    max_time : float
+        Total time budget of each url, from the request to the end of the
+        response body. Unlike timeout, it bounds slow but steady responses
+    transport : str | callable
+        Either 'http1' (requests) or 'http2' (httpx), or a callable taking
+        proxies and headers and returning a transport. See imgdl.transport
+    tracer : imgdl.tracing.Tracer
+        If given, records the timeline of each url
     """
 
     store_path = attr.ib(converter=lambda v: Path(v).expanduser(), default=config['STORE_PATH'])
@@ -75,6 +210,30 @@ class ImageDownloader(object):
     notebook = attr.ib(converter=bool, default=False)
     debug = attr.ib(converter=bool, default=False)
     logfile = attr.ib(default=config.get('LOGFILE'))
+    min_size = attr.ib(converter=attr.converters.optional(to_size), default=config['MIN_SIZE'])
+    max_pixels = attr.ib(converter=attr.converters.optional(int), default=config['MAX_PIXELS'])
+    aspect_ratio = attr.ib(converter=attr.converters.optional(tuple), default=config['ASPECT_RATIO'])
+    formats = attr.ib(default=config['FORMATS'])
+    cache_max_size = attr.ib(converter=attr.converters.optional(parse_size),
+                             default=config['CACHE_MAX_SIZE'])
+    cache_max_files = attr.ib(converter=attr.converters.optional(int),
+                              default=config['CACHE_MAX_FILES'])
+    cache_policy = attr.ib(converter=str, default=config['CACHE_POLICY'])
+    max_time = attr.ib(converter=attr.converters.optional(float), default=config['MAX_TIME'])
+    transport = attr.ib(default=config['TRANSPORT'])
+    tracer = attr.ib(converter=lambda v: NullTracer() if v is None else v, default=None)
+
+    @max_pixels.validator
+    def disable_pillow_limit(self, attribute, value):
+        # max_pixels is checked on the header, before decoding. Pillow would
+        # otherwise warn about, or reject, images under max_pixels
+        Image.MAX_IMAGE_PIXELS = None
+
+    @formats.validator
+    def normalize_formats(self, attribute, value):
+        if isinstance(value, str):
+            value = [value]
+        self.formats = None if value is None else [fmt.upper() for fmt in value]
 
     @user_agent.validator
     def update_headers(self, attribute, value):
@@ -112,7 +271,52 @@ class ImageDownloader(object):
         if (self.logfile is None) and (not value):
             logging.disable(logging.CRITICAL)
 
-    def __call__(self, urls, force=False):
+    @transport.validator
+    def resolve_transport(self, attribute, value):
+        if callable(value):
+            self.make_transport = value
+        elif value not in TRANSPORTS:
+            raise ValueError(f"transport should be one of {list(TRANSPORTS)} or a callable")
+        elif value == 'http2' and not HTTP2_AVAILABLE:
+            self.logger.warning("httpx and h2 are not installed, falling back to HTTP/1.1")
+            self.make_transport = RequestsTransport
+        else:
+            self.make_transport = TRANSPORTS[value]
+
+    def __attrs_post_init__(self):
+        self._transports = {}
+        self._transports_lock = threading.Lock()
+        self.cache = None
+        # Once store_path has an index, every download keeps it up to date,
+        # budget or not, so that ``imgdl gc`` sees all the images
+        has_budget = (self.cache_max_size is not None) or (self.cache_max_files is not None)
+        if has_budget or Path(self.store_path, INDEX_NAME).exists():
+            self.cache = CacheIndex(self.store_path, max_size=self.cache_max_size,
+                                    max_files=self.cache_max_files, policy=self.cache_policy)
+
+    def get_transport(self):
+        """Get the transport of a randomly chosen proxy.
+
+        Transports are kept per proxy and shared by all the threads, so that
+        their connections are reused across downloads.
+        """
+        proxies = random.choice(self.proxies) if self.proxies else None
+        key = proxies['http'] if proxies else None
+        with self._transports_lock:
+            if key not in self._transports:
+                self._transports[key] = self.make_transport(proxies=proxies, headers=self.headers)
+            return self._transports[key]
+
+    def close(self):
+        """Close the connections of the transports and the cache index"""
+        with self._transports_lock:
+            for transport in self._transports.values():
+                transport.close()
+            self._transports = {}
+        if self.cache is not None:
+            self.cache.close()
+
+    def __call__(self, urls, force=False, priorities=None, deadline=None, cancel=None):
         """Download url or list of urls
 
         Parameters
@@ -123,12 +327,24 @@ class ImageDownloader(object):
         force : bool
             If True force the download even if the files already exists
 
+        priorities : dict
+            Priority of the urls. Queued urls with higher priority are
+            downloaded first. Urls not given have priority 0
+
+        deadline : float
+            Number of seconds after which the batch is cancelled
+
+        cancel : CancelToken
+            Handle to cancel the batch from another thread
+
         Returns
         -------
-        paths : str | list
+        paths : str | Paths
             If url is a str, path where the image was stored.
             If url is iterable the list of image paths is returned. If
-            image failed to download, None is given instead of image path
+            image failed to download, or was not downloaded before the
+            batch was cancelled, None is given instead of image path.
+            Its ``rejected`` attribute gives the reason of each rejected url
         """
 
         if self.debug:
@@ -137,37 +353,123 @@ class ImageDownloader(object):
             separation = '=' * max(map(len, arguments.split("\n")))
             print(f"{separation}\n{title}\n{arguments}\n{separation}")
 
-        if not isinstance(urls, (str, collections.Iterable)):
+        if not isinstance(urls, (str, collections.abc.Iterable)):
             raise ValueError("urls should be str or iterable")
 
-        if isinstance(urls, str):
-            return str(self._download_image(urls, force=force))
-
-        with futures.ThreadPoolExecutor(max_workers=self.n_workers) as executor:
-            n_fail = 0
-            future_to_url = {
-                executor.submit(self._download_image, url, force): (i, url)
-                for i, url in enumerate(urls)
-            }
-            total = len(future_to_url)
-            paths = [None] * total
-            for future in self.tqdm(futures.as_completed(future_to_url), total=total, miniters=1):
-                i, url = future_to_url[future]
-                if future.exception() is None:
-                    paths[i] = str(future.result())
-                else:
-                    n_fail += 1
-
-            self.logger.warning(f"{n_fail} images failed to download")
-
-        return paths
-
-    def _download_image(self, url, force=False, session=None, timeout=None):
+        # The deadline of the call must not change the token of the caller
+        cancel = CancelToken(deadline, parent=cancel)
+        try:
+            if isinstance(urls, str):
+                return str(self._download_image(urls, force=force, cancel=cancel))
+            return self._download_batch(urls, force=force, priorities=priorities, cancel=cancel)
+        finally:
+            cancel.close()
+
+    def _download_batch(self, urls, force, priorities, cancel):
+        """Download an iterable of urls, see ``__call__``"""
+        priorities = priorities or {}
+        total = len(urls) if isinstance(urls, collections.abc.Sized) else None
+        paths = []
+        queue = []
+        running = {}
+        rejected = {}
+        finished = collections.deque()
+        counts = collections.Counter()
+        cond = threading.Condition()
+        producer = {'exhausted': False, 'error': None, 'closed': False}
+
+        def produce():
+            # Urls are queued as they come, from a thread of their own, so
+            # that downloads go on while a generator is busy producing them
+            try:
+                for url in urls:
+                    with cond:
+                        if producer['closed'] or cancel.cancelled:
+                            return
+                        paths.append(None)
+                        heapq.heappush(queue, (-priorities.get(url, 0), len(paths) - 1,
+                                               self.tracer.now(), url))
+                        cond.notify()
+            except Exception as e:
+                producer['error'] = e
+            finally:
+                with cond:
+                    producer['exhausted'] = True
+                    cond.notify()
+
+        def on_done(future):
+            with cond:
+                finished.append(future)
+                cond.notify()
+
+        def on_cancel():
+            with cond:
+                cond.notify()
+
+        with futures.ThreadPoolExecutor(max_workers=self.n_workers) as executor, \
+                self.tqdm(total=total, miniters=1) as progress, cond:
+
+            threading.Thread(target=produce, name='imgdl-producer', daemon=True).start()
+            cancel.add_callback(on_cancel)
+            try:
+                while True:
+                    while finished:
+                        future = finished.popleft()
+                        i, url = running.pop(future)
+                        exception = future.exception()
+                        if exception is None:
+                            paths[i] = str(future.result())
+                        elif isinstance(exception, ImageRejected):
+                            counts['rejected'] += 1
+                            rejected[url] = exception.reason
+                        elif isinstance(exception, Cancelled):
+                            counts['cancelled'] += 1
+                        else:
+                            counts['failed'] += 1
+                        progress.update()
+
+                    while queue and (len(running) < self.n_workers) and not cancel.cancelled:
+                        _, i, queued, url = heapq.heappop(queue)
+                        future = executor.submit(self._download_image, url, force,
+                                                 cancel=cancel, queued=queued)
+                        running[future] = i, url
+                        future.add_done_callback(on_done)
+
+                    if producer['error'] is not None:
+                        raise producer['error']
+                    if not running and (cancel.cancelled or (producer['exhausted'] and not queue)):
+                        break
+                    # Downloads that finished before their callback was added
+                    # are already collectable
+                    if not finished:
+                        cond.wait(timeout=None if cancel.cancelled else cancel.remaining())
+            finally:
+                # A generator still running must not change the returned list
+                producer['closed'] = True
+                cancel.remove_callback(on_cancel)
+            paths = list(paths)
+
+        if total is not None:
+            paths += [None] * (total - len(paths))
+
+        message = f"{counts['failed']} images failed to download, {counts['rejected']} were rejected"
+        if cancel.cancelled:
+            n_skipped = len(paths) - sum(counts.values()) - sum(path is not None for path in paths)
+            message += f", {counts['cancelled'] + n_skipped} were cancelled"
+        self.logger.warning(message)
+
+        return Paths(paths, rejected)
+
+    def _download_image(self, url, force=False, session=None, timeout=None, cancel=None, queued=None):
         """Download image and convert to jpeg rgb mode.
 
         If the image path already exists, it considers that the file has
         already been downloaded and does not downloaded again.
 
+        The image is checked against the filters as soon as its header
+        arrives, so that rejected images are neither fully downloaded nor
+        decoded. The reason of a rejection is given by ``ImageRejected``.
+
 
         Parameters
         ----------
@@ -184,56 +486,188 @@ class ImageDownloader(object):
         timeout : float
             Timeout to be given to the url request
 
+        cancel : CancelToken
+            If given, the download is aborted when it is cancelled
+
+        queued : float
+            Time at which the url was queued, for tracing
+
         Returns
         -------
         path : str
             Path where the image was stored
         """
-        metadata = {
-            'success': False,
-            'url': url,
-        }
-        path = Path(self.store_path, hashlib.sha1(to_bytes(url)).hexdigest() + '.jpg')
-        if path.exists() and not force:
-            metadata.update({
-                'success': True,
-                'filepath': path
-            })
-            self.logger.info('On cache', extra=metadata)
+        if queued is not None:
+            self.tracer.add('queue wait', queued, url=url)
+        with self.tracer.span('download', url=url):
+            metadata = {
+                'success': False,
+                'url': url,
+            }
+            path = Path(self.store_path, hashlib.sha1(to_bytes(url)).hexdigest() + '.jpg')
+            # An image missing from the index may be under eviction
+            if path.exists() and not force and (self.cache is None or self.cache.touch(path)):
+                metadata.update({
+                    'success': True,
+                    'filepath': path
+                })
+                self.logger.info('On cache', extra=metadata)
+                return path
+            try:
+                started = monotonic()
+                self._check_budget(started, cancel)
+                with self.tracer.span('session', url=url):
+                    if session is not None:
+                        transport = RequestsTransport(session=session)
+                    else:
+                        transport = self.get_transport()
+                timeout = timeout or self.timeout
+                if self.max_time is not None:
+                    timeout = min(timeout, self.max_time)
+                if cancel is not None and cancel.remaining() is not None:
+                    timeout = min(timeout, max(cancel.remaining(), 0.001))
+                metadata['session'] = {
+                    'headers': dict(transport.headers),
+                    'id': transport.id,
+                    'proxy': transport.proxy,
+                    'timeout': timeout,
+                    'transport': transport.name,
+                }
+                # Connection and time to first byte
+                with self.tracer.span('request', url=url):
+                    response = transport.get(url, timeout=timeout, trace=self.tracer.httpx_trace(url))
+                try:
+                    metadata['response'] = {
+                        'headers': dict(response.headers),
+                        'status_code': response.status_code,
+                    }
+                    with self.tracer.span('body', url=url):
+                        orig_img = self._read_image(response, started=started, cancel=cancel)
+                finally:
+                    response.close()
+                with self.tracer.span('decode', url=url):
+                    orig_img.load()
+                with self.tracer.span('convert', url=url):
+                    img, buf = self.convert_image(orig_img)
+                with self.tracer.span('write', url=url):
+                    if self.cache is None:
+                        path.write_bytes(buf.getvalue())
+                    else:
+                        # Moved in place by the index, safely from evictions
+                        tmp_path = path.with_name(f".{path.name}.{uuid4().hex}.tmp")
+                        try:
+                            tmp_path.write_bytes(buf.getvalue())
+                            self.cache.add(path, tmp_path)
+                        finally:
+                            if tmp_path.exists():
+                                tmp_path.unlink()
+                if self.cache is not None:
+                    with self.tracer.span('evict', url=url):
+                        self.cache.maybe_evict()
+                metadata.update({
+                    'success': True,
+                    'filepath': path,
+                })
+
+                self.logger.info('Downloaded', extra=metadata)
+                wait = random.uniform(self.min_wait, self.max_wait)
+                with self.tracer.span('politeness sleep', url=url):
+                    if cancel is not None:
+                        cancel.wait(wait)
+                    else:
+                        sleep(wait)
+            except Cancelled as e:
+                self.logger.info('Cancelled', extra=metadata)
+                raise e
+            except ImageRejected as e:
+                metadata['rejected'] = e.reason
+                self.logger.info('Rejected', extra=metadata)
+                raise e
+            except Exception as e:
+                metadata['Exception'] = {
+                    'type': type(e),
+                    'msg': str(e),
+                }
+                self.logger.error(f'Failed', extra=metadata)
+                raise e
             return path
+
+    def _check_budget(self, started, cancel=None):
+        """Raise if the download was cancelled or exceeded max_time"""
+        if cancel is not None and cancel.cancelled:
+            raise Cancelled("Batch was cancelled")
+        if self.max_time is not None and monotonic() - started > self.max_time:
+            raise TimeoutError(f"Download took more than {self.max_time} seconds")
+
+    def _read_image(self, response, started=None, cancel=None):
+        """Read the response body, checking the image header as soon as the
+        first bytes have arrived and before any pixel is decoded.
+
+        Raises
+        ------
+        ImageRejected
+            If the image does not pass the filters
+        Cancelled
+            If the batch was cancelled while reading
+        TimeoutError
+            If reading exceeded max_time
+        """
+        started = started or monotonic()
+        data = BytesIO()
+        checked = False
+        for chunk in response.iter_content(CHUNK_SIZE):
+            self._check_budget(started, cancel)
+            data.write(chunk)
+            if not checked:
+                header = self._open_header(data.getvalue())
+                if header is not None:
+                    self.check_image(header)
+                checked = (header is not None) or (data.tell() >= HEADER_MAX_BYTES)
+
+        img = Image.open(BytesIO(data.getvalue()))
+        if not checked:
+            self.check_image(img)
+        return img
+
+    @staticmethod
+    def _open_header(data):
+        """Lazily open an image from its first bytes, or None if there is not
+        enough data yet to parse its header"""
         try:
-            session = session or make_session(proxies=random.choice(self.proxies), headers=self.headers)
-            timeout = timeout or self.timeout
-            metadata['session'] = {
-                'headers': dict(session.headers),
-                'id': session.id,
-                'proxy': session.proxies.get('http'),
-                'timeout': timeout,
-            }
-            response = session.get(url, timeout=timeout)
-            metadata['response'] = {
-                'headers': dict(response.headers),
-                'status_code': response.status_code,
-            }
-            orig_img = Image.open(BytesIO(response.content))
-            img, buf = self.convert_image(orig_img)
-            with path.open('wb') as f:
-                f.write(buf.getvalue())
-            metadata.update({
-                'success': True,
-                'filepath': path,
-            })
-
-            self.logger.info('Downloaded', extra=metadata)
-            sleep(random.uniform(self.min_wait, self.max_wait))
-        except Exception as e:
-            metadata['Exception'] = {
-                'type': type(e),
-                'msg': str(e),
-            }
-            self.logger.error(f'Failed', extra=metadata)
-            raise e
-        return path
+            return Image.open(BytesIO(data))
+        except Image.DecompressionBombError as e:
+            raise ImageRejected(str(e))
+        except Exception:
+            return None
+
+    def check_image(self, img):
+        """Check the image against the filters of the downloader.
+
+        Only the format and size read from the header are used, so this is
+        meant to be called on a lazily opened image before decoding it.
+
+        Parameters
+        ----------
+        img : Pil.Image
+
+        Raises
+        ------
+        ImageRejected
+            If the image does not pass the filters
+        """
+        width, height = img.size
+        if self.formats is not None and img.format not in self.formats:
+            raise ImageRejected(f"Format {img.format} not in {self.formats}")
+        if self.min_size is not None and (width < self.min_size[0] or height < self.min_size[1]):
+            raise ImageRejected(f"Size {width}x{height} smaller than "
+                                f"{self.min_size[0]}x{self.min_size[1]}")
+        if self.max_pixels is not None and width * height > self.max_pixels:
+            raise ImageRejected(f"{width * height} pixels exceed the maximum of {self.max_pixels}")
+        if self.aspect_ratio is not None:
+            ratio = width / height if height else float('inf')
+            min_ratio, max_ratio = self.aspect_ratio
+            if not min_ratio <= ratio <= max_ratio:
+                raise ImageRejected(f"Aspect ratio {ratio:.2f} out of [{min_ratio}, {max_ratio}]")
 
     @staticmethod
     def convert_image(img, size=None):
@@ -285,7 +719,20 @@ def download(urls,
              notebook=False,
              debug=False,
              force=False,
-             logfile=config.get('LOGFILE')):
+             logfile=config.get('LOGFILE'),
+             min_size=config['MIN_SIZE'],
+             max_pixels=config['MAX_PIXELS'],
+             aspect_ratio=config['ASPECT_RATIO'],
+             formats=config['FORMATS'],
+             cache_max_size=config['CACHE_MAX_SIZE'],
+             cache_max_files=config['CACHE_MAX_FILES'],
+             cache_policy=config['CACHE_POLICY'],
+             max_time=config['MAX_TIME'],
+             transport=config['TRANSPORT'],
+             priorities=None,
+             deadline=None,
+             cancel=None,
+             trace=None):
     """Asynchronously download images using multiple threads.
 
     Parameters
@@ -316,13 +763,46 @@ def download(urls,
         If True force the download even if the files already exists
     logfile : str
         Path to logfile
+    min_size : int | tuple
+        Minimum (width, height) of the images to keep. An int applies to
+        both dimensions
+    max_pixels : int
+        Maximum number of pixels of the images to keep
+    aspect_ratio : tuple
+        (min, max) width / height ratio of the images to keep
+    formats : list
+        Image formats to keep, as named by Pillow (e.g. JPEG, PNG, GIF)
+    cache_max_size : int | str
+        Disk budget of store_path, in bytes or as a human readable size
+        like '500G'. Least used images are evicted when it is exceeded
+    cache_max_files : int
+        Maximum number of images kept on store_path
+    cache_policy : str
+        Eviction policy, either 'lru' or 'lfu'
+    max_time : float
+        Total time budget of each url, from the request to the end of the
+        response body
+    transport : str | callable
+        Either 'http1' (requests) or 'http2' (httpx), or a callable taking
+        proxies and headers and returning a transport
+    priorities : dict
+        Priority of the urls. Queued urls with higher priority are
+        downloaded first. Urls not given have priority 0
+    deadline : float
+        Number of seconds after which the batch is cancelled
+    cancel : CancelToken
+        Handle to cancel the batch from another thread
+    trace : str
+        If given, path where the timeline of each url is written as Chrome
+        trace event JSON, to be opened with chrome://tracing or Perfetto
 
     Returns
     -------
-    paths : str | list
+    paths : str | Paths
         If url is a str, path where the image was stored.
         If url is iterable the list of image paths is returned. If
-        image failed to download, None is given instead of image path
+        image failed to download, None is given instead of image path.
+        Its ``rejected`` attribute gives the reason of each rejected url
     """
     downloader = ImageDownloader(
         store_path,
@@ -336,6 +816,21 @@ def download(urls,
         notebook=notebook,
         debug=debug,
         logfile=logfile,
+        min_size=min_size,
+        max_pixels=max_pixels,
+        aspect_ratio=aspect_ratio,
+        formats=formats,
+        cache_max_size=cache_max_size,
+        cache_max_files=cache_max_files,
+        cache_policy=cache_policy,
+        max_time=max_time,
+        transport=transport,
+        tracer=None if trace is None else Tracer(),
     )
 
-    return downloader(urls, force=force)
+    try:
+        return downloader(urls, force=force, priorities=priorities, deadline=deadline, cancel=cancel)
+    finally:
+        downloader.close()
+        if trace is not None:
+            downloader.tracer.dump(trace)
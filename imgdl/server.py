@@ -0,0 +1,450 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Long running image download daemon with a local HTTP API.
+
+A single ``ImageDownloader`` instance, with its warm sessions, is shared by
+every job submitted to the daemon. Jobs are scheduled round robin on one
+global pool of worker threads, so that many small jobs coming from
+different processes share capacity and per host politeness limits.
+"""
+
+import collections
+import json
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+import attr
+import requests
+
+from .downloader import ImageDownloader, ImageRejected
+from .settings import config
+
+
+class HostLimiter(object):
+    """Count the simultaneous downloads per host.
+
+    Acquiring never blocks, so that a worker can move on to a url of
+    another host instead of waiting for a busy one. Hosts without any
+    download running are forgotten.
+
+    Parameters
+    ----------
+    max_per_host : int
+        Maximum number of simultaneous downloads on a same host
+    """
+
+    def __init__(self, max_per_host=config['MAX_PER_HOST']):
+        self.max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._running = {}
+
+    @staticmethod
+    def host(url):
+        """Host of url, or None if url is not a valid url string"""
+        if not isinstance(url, str):
+            return None
+        try:
+            return urlsplit(url).netloc
+        except ValueError:
+            return None
+
+    def available(self, host):
+        """Whether a download slot is free on host"""
+        with self._lock:
+            return self._running.get(host, 0) < self.max_per_host
+
+    def acquire(self, host):
+        """Take a download slot on host, if one is free"""
+        with self._lock:
+            n_running = self._running.get(host, 0)
+            if n_running >= self.max_per_host:
+                return False
+            self._running[host] = n_running + 1
+            return True
+
+    def release(self, host):
+        with self._lock:
+            self._running[host] -= 1
+            if not self._running[host]:
+                del self._running[host]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._running)
+
+
+@attr.s
+class Job(object):
+    """Batch of urls submitted to the daemon.
+
+    Parameters
+    ----------
+    urls : list
+        List of urls to be downloaded
+    force : bool
+        If True force the download even if the files already exists
+    """
+
+    urls = attr.ib(converter=list)
+    force = attr.ib(converter=bool, default=False)
+    id = attr.ib(factory=lambda: uuid4().hex)
+    created = attr.ib(factory=time.time)
+
+    def __attrs_post_init__(self):
+        self.paths = [None] * len(self.urls)
+        # Queued urls by host, as (index, url) pairs
+        self.pending = collections.OrderedDict()
+        self.n_pending = 0
+        self.n_started = 0
+        self.n_done = 0
+        self.n_fail = 0
+        self.rejected = {}
+        self.finished = None if self.urls else time.time()
+        for i, url in enumerate(self.urls):
+            host = HostLimiter.host(url)
+            # Invalid urls fail at once instead of reaching the workers
+            if host is None:
+                self.record(i, None)
+            else:
+                self.pending.setdefault(host, collections.deque()).append((i, url))
+                self.n_pending += 1
+
+    @property
+    def status(self):
+        if self.finished is not None:
+            return 'done'
+        if not self.n_started:
+            return 'queued'
+        return 'running'
+
+    def record(self, i, path, reason=None):
+        """Record the outcome of the i-th url"""
+        self.paths[i] = path
+        self.n_done += 1
+        if path is None:
+            self.n_fail += 1
+        if reason is not None:
+            self.rejected[i] = reason
+        if self.n_done == len(self.urls):
+            self.finished = time.time()
+
+    def as_dict(self, paths=True):
+        info = {
+            'id': self.id,
+            'status': self.status,
+            'total': len(self.urls),
+            'done': self.n_done,
+            'failed': self.n_fail,
+            'rejected': len(self.rejected),
+            'created': self.created,
+            'finished': self.finished,
+        }
+        if paths:
+            info['paths'] = list(self.paths)
+            info['reasons'] = {self.urls[i]: reason for i, reason in self.rejected.items()}
+        return info
+
+
+class Scheduler(object):
+    """Global scheduler sharing a pool of workers among jobs.
+
+    Queued urls are kept per host, and workers only pick from hosts with a
+    free download slot. Hosts take turns, and so do the jobs queued on a
+    same host, so that a large job does not starve the small ones submitted
+    after it, nor a busy host the idle ones. Picking a url does not depend
+    on the number of queued urls.
+
+    Parameters
+    ----------
+    downloader : ImageDownloader
+        Downloader shared by all the jobs
+    max_per_host : int
+        Maximum number of simultaneous downloads on a same host
+    max_jobs : int
+        Maximum number of finished jobs kept in memory for status queries
+    """
+
+    def __init__(self, downloader, max_per_host=config['MAX_PER_HOST'], max_jobs=1000):
+        self.downloader = downloader
+        self.limiter = HostLimiter(max_per_host)
+        self.max_jobs = max_jobs
+        self.jobs = collections.OrderedDict()
+        # Jobs with queued urls per host, with the deque of their urls
+        self._queues = {}
+        # Hosts with queued urls and a free slot, in turn order
+        self._ready = collections.OrderedDict()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._workers = [
+            threading.Thread(target=self._work, name=f"imgdl-worker-{i}", daemon=True)
+            for i in range(downloader.n_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, urls, force=False):
+        """Queue a batch of urls and return its job"""
+        job = Job(urls, force=force)
+        with self._cond:
+            self.jobs[job.id] = job
+            for host, pending in job.pending.items():
+                self._queues.setdefault(host, collections.deque()).append((job, pending))
+                if self.limiter.available(host):
+                    self._ready[host] = None
+            if self._ready:
+                self._cond.notify()
+            self._forget_finished()
+        return job
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': len(self._workers),
+                'jobs': len(self.jobs),
+                'active_jobs': sum(bool(job.n_pending) for job in self.jobs.values()),
+                'queued_urls': sum(job.n_pending for job in self.jobs.values()),
+                'busy_hosts': len(self.limiter),
+            }
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished is not None]
+        for job_id in finished[:max(0, len(finished) - self.max_jobs)]:
+            del self.jobs[job_id]
+
+    def _pick(self):
+        """Pop the next url of the next ready host, or None if no host is
+        ready"""
+        if not self._ready:
+            return None
+        host, _ = self._ready.popitem(last=False)
+        jobs = self._queues[host]
+        job, pending = jobs.popleft()
+        i, url = pending.popleft()
+        if pending:
+            jobs.append((job, pending))
+        else:
+            del job.pending[host]
+        if not jobs:
+            del self._queues[host]
+        self.limiter.acquire(host)
+        if jobs and self.limiter.available(host):
+            self._ready[host] = None
+        job.n_pending -= 1
+        job.n_started += 1
+        return job, i, url, host
+
+    def _next(self):
+        with self._cond:
+            while not self._stopped:
+                task = self._pick()
+                if task is not None:
+                    # Pass the turn to another waiting worker
+                    if self._ready:
+                        self._cond.notify()
+                    return task
+                # Wait for a new job or for a host to be released
+                self._cond.wait()
+            return None
+
+    def _work(self):
+        while True:
+            task = self._next()
+            if task is None:
+                return
+            job, i, url, host = task
+            path = reason = None
+            try:
+                path = str(self.downloader._download_image(url, force=job.force))
+            except ImageRejected as e:
+                reason = e.reason
+            except Exception:
+                pass
+            with self._cond:
+                self.limiter.release(host)
+                if host in self._queues and host not in self._ready:
+                    self._ready[host] = None
+                    self._cond.notify()
+                job.record(i, path, reason)
+                if job.finished is not None:
+                    self.downloader.logger.warning(
+                        f"Job {job.id}: {job.n_fail} images failed to download"
+                    )
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def _reply(self, code, content):
+        body = json.dumps(content).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        scheduler = self.server.scheduler
+        parts = self.path.strip('/').split('/')
+        if parts == ['status']:
+            self._reply(200, scheduler.stats())
+        elif parts == ['jobs']:
+            with scheduler._cond:
+                jobs = [job.as_dict(paths=False) for job in scheduler.jobs.values()]
+            self._reply(200, jobs)
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            with scheduler._cond:
+                job = scheduler.jobs.get(parts[1])
+                info = job and job.as_dict()
+            if info is None:
+                self._reply(404, {'error': f"Unknown job {parts[1]}"})
+            else:
+                self._reply(200, info)
+        else:
+            self._reply(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path.strip('/') != 'jobs':
+            return self._reply(404, {'error': f"Unknown path {self.path}"})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(payload, dict):
+                raise ValueError("body should be a JSON object")
+            urls = payload['urls']
+            if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+                raise ValueError("urls should be a list of strings")
+            force = payload.get('force', False)
+            if not isinstance(force, bool):
+                raise ValueError("force should be a boolean")
+        except KeyError as e:
+            return self._reply(400, {'error': f"Missing {e}"})
+        except (TypeError, ValueError) as e:
+            return self._reply(400, {'error': str(e)})
+        job = self.server.scheduler.submit(urls, force=force)
+        self._reply(201, job.as_dict(paths=False))
+
+    def log_message(self, format, *args):
+        self.server.scheduler.downloader.logger.info(format % args)
+
+
+class DownloadServer(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTP server exposing a shared download scheduler on localhost.
+
+    Parameters
+    ----------
+    downloader : ImageDownloader
+        Downloader shared by all the jobs
+    host : str
+        Interface to bind the server to
+    port : int
+        Port to listen to. Use 0 to pick a free port
+    max_per_host : int
+        Maximum number of simultaneous downloads on a same host
+    """
+
+    daemon_threads = True
+
+    def __init__(self, downloader, host=config['SERVER_HOST'], port=config['SERVER_PORT'],
+                 max_per_host=config['MAX_PER_HOST']):
+        super().__init__((host, port), _RequestHandler)
+        self.scheduler = Scheduler(downloader, max_per_host=max_per_host)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def server_close(self):
+        self.scheduler.stop()
+        super().server_close()
+        self.scheduler.downloader.close()
+
+
+class Client(object):
+    """Thin client of the imgdl daemon.
+
+    Parameters
+    ----------
+    url : str
+        Base url of the daemon
+    """
+
+    def __init__(self, url=f"http://{config['SERVER_HOST']}:{config['SERVER_PORT']}"):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+
+    def _request(self, method, path, **kwargs):
+        response = self.session.request(method, f"{self.url}/{path}", **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def submit(self, urls, force=False):
+        """Submit a batch of urls and return the job id"""
+        return self._request('POST', 'jobs', json={'urls': list(urls), 'force': force})['id']
+
+    def job(self, job_id):
+        """Status, progress and paths of a job"""
+        return self._request('GET', f'jobs/{job_id}')
+
+    def jobs(self):
+        """Status and progress of all the jobs known by the daemon"""
+        return self._request('GET', 'jobs')
+
+    def status(self):
+        """Global status of the daemon"""
+        return self._request('GET', 'status')
+
+    def wait(self, job_id, poll=0.5):
+        """Wait for a job to finish and return its paths"""
+        while True:
+            job = self.job(job_id)
+            if job['status'] == 'done':
+                return job['paths']
+            time.sleep(poll)
+
+    def download(self, urls, force=False, poll=0.5):
+        """Download a batch of urls through the daemon.
+
+        Returns
+        -------
+        paths : list
+            The list of image paths. If image failed to download, None is
+            given instead of image path
+        """
+        return self.wait(self.submit(urls, force=force), poll=poll)
+
+
+def serve(host=config['SERVER_HOST'], port=config['SERVER_PORT'],
+          max_per_host=config['MAX_PER_HOST'], **kwargs):
+    """Run the imgdl daemon until interrupted.
+
+    Parameters
+    ----------
+    host : str
+        Interface to bind the server to
+    port : int
+        Port to listen to
+    max_per_host : int
+        Maximum number of simultaneous downloads on a same host
+    kwargs :
+        Parameters given to ``ImageDownloader``
+    """
+    server = DownloadServer(ImageDownloader(**kwargs), host=host, port=port,
+                            max_per_host=max_per_host)
+    print(f"imgdl serving on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
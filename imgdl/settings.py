@@ -8,6 +8,7 @@ from multiprocessing import cpu_count
 import yaml
 from pythonjsonlogger import jsonlogger
 import requests
+from PIL import Image
 
 PACKAGE_NAME = "imgdl"
 
@@ -19,7 +20,19 @@ config = {
     'MAX_WAIT': 0.0,
     'PROXIES': None,
     'USER_AGENT': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:55.0) Gecko/20100101 Firefox/55.0',
-    'HEADERS': requests.utils.default_headers()
+    'HEADERS': requests.utils.default_headers(),
+    'SERVER_HOST': '127.0.0.1',
+    'SERVER_PORT': 8642,
+    'MAX_PER_HOST': 8,
+    'MIN_SIZE': None,
+    'MAX_PIXELS': Image.MAX_IMAGE_PIXELS,
+    'ASPECT_RATIO': None,
+    'FORMATS': None,
+    'CACHE_MAX_SIZE': None,
+    'CACHE_MAX_FILES': None,
+    'CACHE_POLICY': 'lru',
+    'MAX_TIME': None,
+    'TRANSPORT': 'http1',
 }
 
 config['HEADERS'].update(
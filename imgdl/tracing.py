@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Per url timeline tracing and sampling profiler for imgdl runs.
+
+Traces are exported as Chrome trace events, which can be opened with
+chrome://tracing or https://ui.perfetto.dev
+"""
+
+import collections
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter
+
+# Spans built from the trace events of httpx, which the requests transport
+# reports as well
+HTTPX_SPANS = {
+    'connection.connect_tcp': 'connect',
+    'connection.start_tls': 'tls',
+    'http11.receive_response_headers': 'ttfb',
+    'http2.receive_response_headers': 'ttfb',
+}
+
+
+class NullTracer(object):
+    """Tracer doing nothing, used when tracing is off"""
+
+    def now(self):
+        return None
+
+    @contextmanager
+    def span(self, name, url=None, **args):
+        yield
+
+    def add(self, name, start, end=None, url=None, **args):
+        pass
+
+    def httpx_trace(self, url):
+        return None
+
+
+class Tracer(NullTracer):
+    """Record the spans of each url on a timeline.
+
+    Spans are recorded per thread, with the url they belong to, and can be
+    exported as Chrome trace events.
+    """
+
+    def __init__(self):
+        self.origin = perf_counter()
+        self.events = []
+        self.threads = {}
+
+    def now(self):
+        return perf_counter()
+
+    @contextmanager
+    def span(self, name, url=None, **args):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, url=url, **args)
+
+    def add(self, name, start, end=None, url=None, **args):
+        """Record a span between two ``perf_counter`` times"""
+        end = perf_counter() if end is None else end
+        thread = threading.current_thread()
+        self.threads[thread.ident] = thread.name
+        if url is not None:
+            args['url'] = url
+        self.events.append({
+            'name': name,
+            'cat': 'imgdl',
+            'ph': 'X',
+            'ts': (start - self.origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': thread.ident,
+            'args': args,
+        })
+
+    def httpx_trace(self, url):
+        """httpx style trace callback, recording connection and TTFB spans"""
+        started = {}
+
+        def trace(event_name, info):
+            prefix, _, stage = event_name.rpartition('.')
+            if prefix not in HTTPX_SPANS:
+                return
+            if stage == 'started':
+                started[prefix] = perf_counter()
+            elif prefix in started:
+                self.add(HTTPX_SPANS[prefix], started.pop(prefix), url=url)
+
+        return trace
+
+    def to_chrome(self):
+        """Trace as a Chrome trace event dictionary"""
+        metadata = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+            for tid, name in self.threads.items()
+        ]
+        return {
+            'traceEvents': metadata + list(self.events),
+            'displayTimeUnit': 'ms',
+        }
+
+    def dump(self, path):
+        """Write the trace as Chrome trace event JSON"""
+        Path(path).write_text(json.dumps(self.to_chrome()))
+
+
+class SamplingProfiler(object):
+    """Sample the stacks of every thread at regular intervals.
+
+    Only the part of the stacks starting at the first imgdl frame is kept,
+    so that idle threads and the code calling imgdl are left out.
+
+    Parameters
+    ----------
+    interval : float
+        Seconds between two samples
+    focus : str
+        Only stacks going through files under this directory are kept
+    """
+
+    def __init__(self, interval=0.005, focus=str(Path(__file__).parent)):
+        self.interval = interval
+        self.focus = focus
+        self.stacks = collections.Counter()
+        self.n_samples = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='imgdl-profiler', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+    @staticmethod
+    def _label(code):
+        return f"{Path(code.co_filename).name}:{code.co_name}"
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.n_samples += 1
+            for tid, frame in sys._current_frames().items():
+                if tid == self._thread.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stack.reverse()
+                for i, code in enumerate(stack):
+                    if code.co_filename.startswith(self.focus):
+                        # Leave out the profiler being stopped
+                        if code.co_filename != __file__:
+                            self.stacks[tuple(self._label(code) for code in stack[i:])] += 1
+                        break
+
+    def top(self, n=20):
+        """Functions with the most samples, including the time spent in
+        the functions they call"""
+        inclusive = collections.Counter()
+        for stack, count in self.stacks.items():
+            for label in set(stack):
+                inclusive[label] += count
+        return inclusive.most_common(n)
+
+    def dump(self, path):
+        """Write the samples as collapsed stacks, readable by flamegraph.pl
+        or https://www.speedscope.app"""
+        Path(path).write_text(''.join(
+            f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common()
+        ))
+
+    def report(self, n=20):
+        lines = [f"{self.n_samples} samples every {self.interval * 1000:g} ms"]
+        lines += [f"{count:>8}  {label}" for label, count in self.top(n)]
+        return "\n".join(lines)
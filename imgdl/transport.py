@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HTTP transports used to download images.
+
+A transport is built for a given proxy and headers, and is shared by all
+the worker threads of a downloader. Its ``get`` method returns a streamed
+response exposing ``status_code``, ``headers``, ``iter_content`` and
+``close``, like ``requests.Response`` does. Connection and response header
+events are reported to the optional httpx style ``trace`` callback.
+"""
+
+import threading
+from uuid import uuid4
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+try:
+    import httpx
+    import h2  # noqa: F401
+except ImportError:
+    httpx = None
+
+HTTP2_AVAILABLE = httpx is not None
+
+# Connection specific headers are forbidden on HTTP/2
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade'}
+
+
+# Trace callback of the request running on each thread
+_trace = threading.local()
+
+
+class _TracingConnectionMixin(object):
+    """Report the TCP connection and the wait for the response headers of
+    urllib3 connections to the trace callback of the current thread"""
+
+    def _traced(self, name, method, *args, **kwargs):
+        trace = getattr(_trace, 'callback', None)
+        if trace is None:
+            return method(*args, **kwargs)
+        trace(f'{name}.started', {})
+        result = method(*args, **kwargs)
+        trace(f'{name}.complete', {'return_value': result})
+        return result
+
+    def _new_conn(self):
+        return self._traced('connection.connect_tcp', super()._new_conn)
+
+    def getresponse(self, *args, **kwargs):
+        return self._traced('http11.receive_response_headers', super().getresponse, *args, **kwargs)
+
+
+class _TracingHTTPConnection(_TracingConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TracingHTTPSConnection(_TracingConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TracingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TracingHTTPConnection
+
+
+class _TracingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TracingHTTPSConnection
+
+
+TRACING_POOLS = {
+    'http': _TracingHTTPConnectionPool,
+    'https': _TracingHTTPSConnectionPool,
+}
+
+
+class _TracingAdapter(HTTPAdapter):
+    """Adapter whose connections report to the trace callback"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = TRACING_POOLS
+
+    def proxy_manager_for(self, proxy, **kwargs):
+        manager = super().proxy_manager_for(proxy, **kwargs)
+        # SOCKS managers come with pools of their own
+        if not proxy.lower().startswith('socks'):
+            manager.pool_classes_by_scheme = TRACING_POOLS
+        return manager
+
+
+def make_session(proxies=None, headers=None):
+    proxies = proxies or {}
+    headers = headers or {}
+    s = requests.Session()
+    s.proxies.update(proxies)
+    s.headers.update(headers)
+    s.id = uuid4().hex
+
+    return s
+
+
+class _PooledResponse(object):
+    """Streamed requests response giving its session back to the pool once
+    closed"""
+
+    def __init__(self, response, release):
+        self._response = response
+        self._release = release
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    def iter_content(self, chunk_size=None):
+        return self._response.iter_content(chunk_size)
+
+    def close(self):
+        self._response.close()
+        if self._release is not None:
+            self._release()
+            self._release = None
+
+
+class RequestsTransport(object):
+    """HTTP/1.1 transport based on requests.
+
+    Sessions are kept in a pool. Each request takes an idle session, or a
+    new one if none is idle, and gives it back once its response is closed.
+    There are then never more sessions than simultaneous requests, and their
+    connections are kept warm across downloads and batches. The TLS
+    handshake of https urls is not traced apart, it is part of the request.
+
+    Parameters
+    ----------
+    proxies : dict
+        Proxies given to requests, e.g. {"http": proxy, "https": proxy}
+    headers : dict
+        headers to be given to requests
+    session : requests.Session
+        If given, this session is used by all the threads
+    """
+
+    name = 'http1'
+
+    def __init__(self, proxies=None, headers=None, session=None):
+        self.proxies = proxies or {}
+        self.headers = dict(session.headers) if session is not None else dict(headers or {})
+        self.id = getattr(session, 'id', None) or uuid4().hex
+        self._session = session
+        self._lock = threading.Lock()
+        self._idle = []
+        self._sessions = []
+
+    @property
+    def proxy(self):
+        proxies = self._session.proxies if self._session is not None else self.proxies
+        return proxies.get('http')
+
+    def _acquire(self):
+        if self._session is not None:
+            return self._session
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            session = make_session(proxies=self.proxies, headers=self.headers)
+            self._sessions.append(session)
+            return session
+
+    def _release(self, session):
+        with self._lock:
+            # Sessions of a closed transport are not reused
+            if any(session is pooled for pooled in self._sessions):
+                self._idle.append(session)
+
+    def get(self, url, timeout=None, trace=None):
+        session = self._acquire()
+        # Pooled sessions report to the trace callback once tracing is used.
+        # A session given by the user is left as it is
+        traced = trace is not None and session is not self._session
+        if traced and not isinstance(session.get_adapter(url), _TracingAdapter):
+            session.mount('http://', _TracingAdapter())
+            session.mount('https://', _TracingAdapter())
+        _trace.callback = trace
+        try:
+            response = session.get(url, timeout=timeout, stream=True)
+        except BaseException:
+            self._release(session)
+            raise
+        finally:
+            _trace.callback = None
+        return _PooledResponse(response, lambda: self._release(session))
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions, self._idle = self._sessions, [], []
+        for session in sessions:
+            session.close()
+
+
+class _HttpxResponse(object):
+    """Give an httpx streamed response the interface of requests"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.http_version = response.http_version
+
+    def iter_content(self, chunk_size=None):
+        return self._response.iter_bytes(chunk_size)
+
+    def close(self):
+        self._response.close()
+
+
+class Http2Transport(object):
+    """HTTP/2 transport based on httpx.
+
+    A single client is shared by all the threads, so that concurrent
+    downloads from a same host are multiplexed over a few connections.
+    Hosts that do not support HTTP/2 are downloaded through HTTP/1.1.
+
+    Parameters
+    ----------
+    proxies : dict
+        Proxies, e.g. {"http": proxy, "https": proxy}
+    headers : dict
+        headers to be given to the requests
+    max_connections : int
+        Maximum number of simultaneous connections
+    prior_knowledge : bool
+        If True, speak HTTP/2 without negotiation. Needed for HTTP/2 over
+        plain http, but then HTTP/1.1 hosts cannot be reached
+    """
+
+    name = 'http2'
+
+    def __init__(self, proxies=None, headers=None, max_connections=100, prior_knowledge=False):
+        if httpx is None:
+            raise ImportError("HTTP/2 transport requires httpx and h2. "
+                              "Install them with `pip install imgdl[http2]`")
+        self.proxies = proxies or {}
+        self.headers = {
+            key: value for key, value in (headers or {}).items()
+            if key.lower() not in HOP_BY_HOP_HEADERS
+        }
+        self.id = uuid4().hex
+        self.client = httpx.Client(
+            http1=not prior_knowledge,
+            http2=True,
+            headers=self.headers,
+            proxy=self.proxy,
+            limits=httpx.Limits(max_connections=max_connections),
+        )
+
+    @property
+    def proxy(self):
+        return self.proxies.get('http')
+
+    def get(self, url, timeout=None, trace=None):
+        extensions = {'trace': trace} if trace is not None else None
+        request = self.client.build_request('GET', url, timeout=timeout, extensions=extensions)
+        return _HttpxResponse(self.client.send(request, stream=True))
+
+    def close(self):
+        self.client.close()
+
+
+TRANSPORTS = {
+    'http1': RequestsTransport,
+    'http2': Http2Transport,
+}
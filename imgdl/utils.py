@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import hashlib
+import re
 
 
 def md5sum(fname):
@@ -25,4 +26,24 @@ def to_bytes(text, encoding=None, errors='strict'):
                         'object, got %s' % type(text).__name__)
     if encoding is None:
         encoding = 'utf-8'
-    return text.encode(encoding, errors)
\ No newline at end of file
+    return text.encode(encoding, errors)
+
+
+def to_size(value):
+    """Return a (width, height) tuple from an int or a pair of ints"""
+    if isinstance(value, int):
+        return value, value
+    width, height = value
+    return int(width), int(height)
+
+
+def parse_size(size):
+    """Return a number of bytes from an int or a human readable size
+    like '500G' or '1.5 TB'"""
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', size, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid size {size!r}")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' KMGT'.index(unit.upper() or ' '))
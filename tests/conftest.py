@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+from socketserver import BaseRequestHandler, ThreadingMixIn, TCPServer
+
+import pytest
+from PIL import Image
+
+
+def make_image(width, height, fmt='JPEG', noise=False):
+    if noise:
+        img = Image.frombytes('RGB', (width, height), os.urandom(width * height * 3))
+    else:
+        img = Image.new('RGB', (width, height), (200, 30, 30))
+    buf = BytesIO()
+    img.save(buf, fmt)
+    return buf.getvalue()
+
+
+def parse_image_path(path):
+    """Return (slow, width, height, format) from paths like /640x480.png"""
+    match = re.match(r'^(/slow)?/(\d+)x(\d+)\.(\w+)$', path)
+    if match is None:
+        return None
+    slow, width, height, ext = match.groups()
+    return bool(slow), int(width), int(height), {'jpg': 'JPEG'}.get(ext, ext.upper())
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """Serve generated images on paths like /640x480.png
+
+    Images on paths starting with /slow/ are filled with noise, so that
+    they weigh a few hundred KB, and sent by pieces of 8KB every 0.3 seconds.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        image = parse_image_path(self.path)
+        if image is None:
+            self.send_error(404)
+            return
+        slow, width, height, fmt = image
+        body = make_image(width, height, fmt, noise=slow)
+        self.send_response(200)
+        self.send_header('Content-Type', f'image/{fmt.lower()}')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            if slow:
+                step = 8 * 1024
+                for start in range(0, len(body), step):
+                    self.wfile.write(body[start:start + step])
+                    self.wfile.flush()
+                    time.sleep(0.3)
+            else:
+                self.wfile.write(body)
+        except ConnectionError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ImageServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests = []
+
+
+class ServerURL(str):
+    """Base url of a test server, giving access to the paths it was requested"""
+
+    def __new__(cls, url, server):
+        self = super().__new__(cls, url)
+        self.server = server
+        return self
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+
+def serve_images():
+    server = ImageServer(('127.0.0.1', 0), ImageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield ServerURL(f"http://127.0.0.1:{server.server_address[1]}", server)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def image_server():
+    yield from serve_images()
+
+
+@pytest.fixture
+def other_image_server():
+    """Second image server, seen as another host"""
+    yield from serve_images()
+
+
+class H2ImageHandler(BaseRequestHandler):
+    """Serve generated images over HTTP/2 without TLS (prior knowledge)"""
+
+    def handle(self):
+        import h2.config
+        import h2.connection
+        import h2.events
+
+        self.server.connections += 1
+        conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        self.request.sendall(conn.data_to_send())
+        while True:
+            try:
+                data = self.request.recv(65535)
+            except ConnectionError:
+                return
+            if not data:
+                return
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    path = dict(event.headers)[b':path'].decode()
+                    self.server.requests.append(path)
+                    image = parse_image_path(path)
+                    if image is None:
+                        conn.send_headers(event.stream_id, [(':status', '404')], end_stream=True)
+                        continue
+                    _, width, height, fmt = image
+                    body = make_image(width, height, fmt)
+                    conn.send_headers(event.stream_id, [
+                        (':status', '200'),
+                        ('content-type', f'image/{fmt.lower()}'),
+                        ('content-length', str(len(body))),
+                    ])
+                    # Generated images are small enough to ignore flow control
+                    step = conn.max_outbound_frame_size
+                    for start in range(0, len(body), step):
+                        conn.send_data(event.stream_id, body[start:start + step],
+                                       end_stream=start + step >= len(body))
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    return
+            self.request.sendall(conn.data_to_send())
+
+
+class H2ImageServer(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests = []
+        self.connections = 0
+
+
+@pytest.fixture
+def h2_image_server():
+    pytest.importorskip('h2')
+    server = H2ImageServer(('127.0.0.1', 0), H2ImageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield ServerURL(f"http://127.0.0.1:{server.server_address[1]}", server)
+    server.shutdown()
+    server.server_close()
@@ -1,11 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import struct
+import threading
+import time
+import warnings
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
 import pytest
 
-from imgdl.downloader import ImageDownloader
+from imgdl.cli import main
+from imgdl.downloader import CancelToken, ImageDownloader, ImageRejected, download
+
+from .conftest import make_image
 
 
 def test_headers_init():
@@ -42,3 +49,207 @@ def test_make_dirs():
         "store_path should have been created"
 
     store_path.cleanup()
+
+
+def test_header_filters(image_server):
+
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(
+        store_path=store_path.name,
+        min_size=256,
+        max_pixels=1000 * 1000,
+        aspect_ratio=(0.5, 2),
+        formats=['jpeg', 'png'],
+    )
+
+    path = downloader._download_image(f"{image_server}/640x480.png")
+    assert Path(path).exists()
+
+    rejected = {
+        f"{image_server}/16x16.png": "smaller than 256x256",
+        f"{image_server}/2000x1000.jpg": "exceed the maximum",
+        f"{image_server}/900x300.jpg": "Aspect ratio 3.00",
+        f"{image_server}/300x300.gif": "Format GIF",
+    }
+    for url, reason in rejected.items():
+        with pytest.raises(ImageRejected) as excinfo:
+            downloader._download_image(url)
+        assert reason in excinfo.value.reason
+
+    assert len(list(Path(store_path.name).glob('*.jpg'))) == 1, \
+        "Rejected images should not be stored"
+
+    store_path.cleanup()
+
+
+def test_header_read_from_first_bytes():
+    data = make_image(3000, 2000, 'PNG')
+    header = ImageDownloader._open_header(data[:100])
+    assert header.size == (3000, 2000), "Size should be known from the first bytes"
+    assert ImageDownloader._open_header(data[:10]) is None
+
+
+def test_batch_rejection_reasons(image_server):
+    store_path = TemporaryDirectory()
+    urls = [f"{image_server}/200x200.jpg", f"{image_server}/16x16.jpg", "not a url"]
+
+    paths = download(urls, store_path=store_path.name, min_size=100, min_wait=0, max_wait=0)
+    assert paths[0] is not None and paths[1:] == [None, None]
+    assert list(paths.rejected) == [urls[1]], "Only rejected urls should have a reason"
+    assert "smaller than 100x100" in paths.rejected[urls[1]]
+
+    urls_file = Path(store_path.name, 'urls.txt')
+    urls_file.write_text("\n".join(urls))
+    rejected_file = Path(store_path.name, 'rejected.tsv')
+    main([str(urls_file), '-o', store_path.name, '--min_size', '100', '--rejected', str(rejected_file)])
+    url, reason = rejected_file.read_text().splitlines()[0].split('\t')
+    assert url == urls[1] and "smaller than" in reason
+
+    store_path.cleanup()
+
+
+def bmp_header(width, height):
+    """First bytes of a 24 bits BMP image"""
+    return (b'BM' + struct.pack('<IHHI', 0, 0, 0, 54) +
+            struct.pack('<IiiHHIIiiII', 40, width, height, 1, 24, 0, 0, 0, 0, 0, 0))
+
+
+def test_max_pixels_replaces_pillow_limit():
+    downloader = ImageDownloader(max_pixels=10 ** 9)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        for size in (20000, 12000):
+            header = downloader._open_header(bmp_header(size, size))
+            assert header.size == (size, size)
+            downloader.check_image(header)
+
+    downloader = ImageDownloader(max_pixels=10 ** 8)
+    with pytest.raises(ImageRejected):
+        downloader.check_image(downloader._open_header(bmp_header(20000, 20000)))
+
+
+def test_priorities(image_server):
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, n_workers=1)
+
+    urls = [f"{image_server}/{width}x100.jpg" for width in range(100, 105)]
+    paths = downloader(urls, priorities={urls[-1]: 10, urls[-2]: 5})
+
+    assert all(path is not None for path in paths)
+    # The first url may start before the others are queued
+    requested = [f"{image_server}{path}" for path in image_server.requests if path != '/100x100.jpg']
+    assert requested == [urls[-1], urls[-2]] + urls[1:-2], \
+        "Queued urls should be downloaded by order of priority"
+
+    store_path.cleanup()
+
+
+def test_downloads_overlap_with_a_slow_generator(image_server):
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, n_workers=2, min_wait=0, max_wait=0)
+    n_requested = []
+
+    def urls():
+        yield from (f"{image_server}/{width}x100.jpg" for width in range(100, 108))
+        time.sleep(1)
+        n_requested.append(len(image_server.requests))
+        yield f"{image_server}/108x100.jpg"
+
+    paths = downloader(urls())
+    assert n_requested == [8], "Queued urls should be downloaded while the generator sleeps"
+    assert all(Path(path).exists() for path in paths)
+
+    store_path.cleanup()
+
+
+def test_deadline_returns_partial_results(image_server):
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, n_workers=4)
+
+    fast = [f"{image_server}/{width}x100.jpg" for width in range(100, 103)]
+    slow = [f"{image_server}/slow/300x{height}.jpg" for height in range(300, 303)]
+
+    started = time.monotonic()
+    paths = downloader(slow + fast, deadline=1)
+    assert time.monotonic() - started < 2.5, "Deadline should stop in-flight downloads"
+    assert len(paths) == 6
+    assert paths[:3] == [None] * 3
+    assert all(Path(path).exists() for path in paths[3:])
+
+    store_path.cleanup()
+
+
+def test_cancel(image_server):
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, n_workers=2)
+    cancel = CancelToken()
+    threading.Timer(0.5, cancel.cancel).start()
+
+    urls = [f"{image_server}/slow/300x{height}.jpg" for height in range(300, 310)]
+    started = time.monotonic()
+    paths = downloader(urls, cancel=cancel)
+    assert time.monotonic() - started < 2
+    assert paths == [None] * 10
+    assert len(image_server.requests) == 2, "No url should be scheduled after cancellation"
+
+    store_path.cleanup()
+
+
+def test_cancel_wakes_up_a_waiting_batch(image_server):
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, min_wait=0, max_wait=0)
+    cancel = CancelToken()
+    threading.Timer(0.3, cancel.cancel).start()
+
+    def urls():
+        yield f"{image_server}/100x100.jpg"
+        time.sleep(2)
+        yield f"{image_server}/101x100.jpg"
+
+    started = time.monotonic()
+    paths = downloader(urls(), cancel=cancel)
+    assert time.monotonic() - started < 1, "Cancelling should not wait for the generator"
+    assert len(paths) == 1 and paths[0] is not None
+    time.sleep(2)
+    assert len(image_server.requests) == 1, "No url should be queued after the batch returned"
+
+    store_path.cleanup()
+
+
+def test_deadline_does_not_change_the_token(image_server):
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, min_wait=0, max_wait=0)
+    cancel = CancelToken()
+
+    downloader([f"{image_server}/100x100.jpg"], deadline=0.5, cancel=cancel)
+    assert cancel.expires is None
+    assert not cancel._callbacks, "The batch should stop following the token"
+    time.sleep(0.6)
+    assert not cancel.cancelled
+
+    store_path.cleanup()
+
+
+def test_max_time(image_server):
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, max_time=0.5)
+
+    with pytest.raises(TimeoutError):
+        downloader._download_image(f"{image_server}/slow/300x300.jpg")
+
+    store_path.cleanup()
+
+
+def test_sessions_are_reused_across_batches(image_server):
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, n_workers=4, min_wait=0, max_wait=0)
+
+    for batch in range(5):
+        downloader([f"{image_server}/{width}x{100 + batch}.jpg" for width in range(100, 108)])
+    transport = downloader.get_transport()
+    assert 1 <= len(transport._sessions) <= 4, "Sessions should be pooled, not made per thread"
+    assert len(transport._idle) == len(transport._sessions)
+
+    downloader.close()
+    assert not transport._sessions
+    store_path.cleanup()
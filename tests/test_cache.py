@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from imgdl.cache import CacheIndex
+from imgdl.cli import main
+from imgdl.downloader import ImageDownloader
+
+
+def fill(store_path, n_files, size=1000):
+    paths = []
+    for i in range(n_files):
+        path = Path(store_path, f'{i}.jpg')
+        path.write_bytes(b'0' * size)
+        paths.append(path)
+    return paths
+
+
+def test_lru_eviction():
+    store_path = TemporaryDirectory()
+    paths = fill(store_path.name, 10)
+
+    cache = CacheIndex(store_path.name, max_size=5000)
+    assert tuple(cache.usage()) == (10, 10000), "Existing images should be indexed"
+
+    time.sleep(0.01)
+    for path in paths[:3]:
+        cache.touch(path)
+
+    n_removed, freed = cache.evict()
+    assert (n_removed, freed) == (6, 6000), "Eviction should go below the low watermark"
+    assert tuple(cache.usage()) == (4, 4000)
+    remaining = {path.name for path in Path(store_path.name).glob('*.jpg')}
+    assert {'0.jpg', '1.jpg', '2.jpg'} < remaining, "Recently used images should be kept"
+    cache.close()
+
+    store_path.cleanup()
+
+
+def test_gc_command(capsys):
+    store_path = TemporaryDirectory()
+    fill(store_path.name, 10)
+
+    main(['gc', '-o', store_path.name, '--max-files', '5'])
+    assert len(list(Path(store_path.name).glob('*.jpg'))) == 4
+    assert "Removed 6 images" in capsys.readouterr().out
+
+    # Images removed by hand are forgotten when rebuilding the index
+    next(Path(store_path.name).glob('*.jpg')).unlink()
+    main(['gc', '-o', store_path.name, '--max-files', '5', '--rebuild'])
+    assert "3 images" in capsys.readouterr().out
+
+    store_path.cleanup()
+
+
+def test_downloader_budget(image_server):
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, cache_max_files=3)
+
+    for width in range(100, 110):
+        downloader._download_image(f"{image_server}/{width}x100.jpg")
+    assert len(list(Path(store_path.name).glob('*.jpg'))) <= 3
+    assert downloader.cache.usage()[0] <= 3
+
+    store_path.cleanup()
+
+
+def test_downloads_without_budget_are_indexed(image_server, capsys):
+    store_path = TemporaryDirectory()
+    main(['gc', '-o', store_path.name, '--max-files', '5'])
+
+    downloader = ImageDownloader(store_path=store_path.name, min_wait=0, max_wait=0)
+    for width in range(100, 110):
+        downloader._download_image(f"{image_server}/{width}x100.jpg")
+    assert tuple(downloader.cache.usage())[0] == 10, "Existing index should be kept up to date"
+    downloader.close()
+    # Images copied by hand are found without --rebuild
+    fill(store_path.name, 10)
+
+    main(['gc', '-o', store_path.name, '--max-files', '5'])
+    assert "Removed 16 images" in capsys.readouterr().out
+    assert len(list(Path(store_path.name).glob('*.jpg'))) == 4
+
+    store_path.cleanup()
+
+
+def test_image_under_eviction_is_a_miss(image_server):
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, cache_max_files=10,
+                                 min_wait=0, max_wait=0)
+    url = f"{image_server}/100x100.jpg"
+    path = downloader._download_image(url)
+    assert downloader._download_image(url) == path
+    assert len(image_server.requests) == 1
+
+    # Eviction removes the index entry before the file
+    downloader.cache._conn.execute('DELETE FROM files WHERE name = ?', (path.name,))
+    assert not downloader.cache.touch(path)
+    assert downloader._download_image(url) == path
+    assert len(image_server.requests) == 2, "Images under eviction should be downloaded again"
+    assert tuple(downloader.cache.usage()) == (1, path.stat().st_size)
+
+    downloader.close()
+    store_path.cleanup()
+
+
+def test_eviction_and_writes_do_not_interleave(image_server):
+    store_path = TemporaryDirectory()
+    cache = CacheIndex(store_path.name, max_files=10)
+    paths = fill(store_path.name, 20)
+    cache.rebuild()
+
+    # The oldest image is downloaded again while the others are evicted
+    tmp_path = Path(store_path.name, '.0.jpg.tmp')
+    tmp_path.write_bytes(b'1' * 500)
+    evicting = threading.Thread(target=cache.evict)
+    evicting.start()
+    cache.add(paths[0], tmp_path)
+    evicting.join()
+
+    n_files, size = cache.usage()
+    on_disk = sorted(Path(store_path.name).glob('*.jpg'))
+    assert n_files == len(on_disk), "Every index entry should have its file"
+    assert size == sum(path.stat().st_size for path in on_disk)
+    assert not tmp_path.exists()
+    cache.close()
+
+    store_path.cleanup()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('selenium')
+BeautifulSoup = pytest.importorskip('bs4').BeautifulSoup
+
+import google  # noqa: E402
+
+pages = [
+    (Path(__file__).parent / 'google_page_1.html').read_text(),
+    (Path(__file__).parent / 'google_page_2.html').read_text(),
+]
+
+
+class FakeDriver(object):
+    """Replay saved result pages, one more page after each scroll"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.n_scrolls = 0
+        self.offsets = []
+
+    @property
+    def page_source(self):
+        return self.pages[min(self.n_scrolls, len(self.pages) - 1)]
+
+    def execute_script(self, script, *args):
+        if script == google.RESULT_META_SCRIPT:
+            self.offsets.append(args[0])
+            soup = BeautifulSoup(self.page_source, 'lxml')
+            return [meta.text for meta in soup.select('div.rg_di div.rg_meta')][args[0]:]
+        self.n_scrolls += 1
+
+    def find_element_by_id(self, id_):
+        raise AssertionError("More results should not be needed")
+
+
+def test_harvest_only_new_results():
+    driver = FakeDriver(pages)
+    harvester = google.ResultHarvester(driver)
+
+    streamed = []
+    for url in harvester.stream(n_images=7, wait=0):
+        streamed.append((driver.n_scrolls, url))
+
+    assert [scrolls for scrolls, _ in streamed] == [0] * 4 + [1] * 3, \
+        "Urls should be yielded as soon as they are found, before scrolling is over"
+    assert driver.offsets == [0, 4], "Only newly added result nodes should be parsed"
+    assert harvester.urls == [url for _, url in streamed]
+    assert len(set(harvester.urls)) == len(harvester.urls) == 7
+    assert set(harvester.urls) == set(google.parse_urls_from_source(pages[-1]))
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import threading
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+import requests
+
+from imgdl.downloader import ImageDownloader
+from imgdl.server import Client, DownloadServer, HostLimiter, Scheduler
+
+
+@pytest.fixture
+def server():
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, n_workers=4)
+    server = DownloadServer(downloader, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    store_path.cleanup()
+
+
+def test_jobs_share_the_daemon(server):
+    cached = [f'http://images.example.com/{i}.jpg' for i in range(5)]
+    for url in cached:
+        Path(server.scheduler.downloader.store_path,
+             hashlib.sha1(url.encode()).hexdigest() + '.jpg').touch()
+
+    client = Client(server.url)
+    first = client.submit(cached[:3])
+    second = client.submit(cached[3:] + ['not a url'])
+
+    paths = client.wait(first, poll=0.05)
+    assert all(Path(path).exists() for path in paths)
+
+    paths = client.wait(second, poll=0.05)
+    assert paths[-1] is None, "Failed downloads should be given as None"
+    job = client.job(second)
+    assert (job['total'], job['done'], job['failed']) == (3, 3, 1)
+
+    assert {job['id'] for job in client.jobs()} == {first, second}
+    assert client.status()['workers'] == 4
+
+
+def test_busy_host_does_not_starve_other_hosts(image_server, other_image_server):
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, n_workers=2, min_wait=0, max_wait=0)
+    scheduler = Scheduler(downloader, max_per_host=1)
+
+    slow = scheduler.submit([f"{image_server}/slow/300x{height}.jpg" for height in range(300, 304)])
+    time.sleep(0.2)
+    started = time.time()
+    fast = scheduler.submit([f"{other_image_server}/{width}x100.jpg" for width in range(100, 104)])
+    while fast.finished is None:
+        time.sleep(0.05)
+    assert fast.finished - started < 1.5, "Idle hosts should not wait for a busy one"
+    assert fast.n_fail == 0
+    assert slow.finished is None
+    assert len(image_server.requests) == 1, "Only one download should run per host"
+
+    scheduler.stop()
+    downloader.close()
+    store_path.cleanup()
+
+
+def test_host_limiter_forgets_idle_hosts():
+    limiter = HostLimiter(max_per_host=1)
+    assert limiter.acquire('a.example.com')
+    assert not limiter.acquire('a.example.com')
+    assert limiter.acquire('b.example.com')
+    limiter.release('a.example.com')
+    limiter.release('b.example.com')
+    assert len(limiter) == 0
+
+
+def test_pick_does_not_scan_queued_urls():
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, n_workers=1)
+    scheduler = Scheduler(downloader, max_per_host=1)
+    scheduler.stop()
+    scheduler._workers[0].join()
+
+    job = scheduler.submit([f'http://images.example.com/{i}.jpg' for i in range(100000)])
+    other = scheduler.submit(['http://other.example.com/0.jpg'])
+    assert scheduler._pick()[0] is job
+    started = time.monotonic()
+    assert scheduler._pick()[0] is other, "Busy hosts should be skipped"
+    assert scheduler._pick() is None
+    assert time.monotonic() - started < 0.01
+    assert scheduler.stats()['queued_urls'] == 99999
+
+    downloader.close()
+    store_path.cleanup()
+
+
+@pytest.mark.parametrize('body', [
+    b'["a"]',
+    b'{"urls": "http://example.com/a.jpg"}',
+    b'{"urls": ["http://example.com/a.jpg"], "force": "no"}',
+    b'{"force": true}',
+    b'{"urls": [1, null]}',
+    b'not json',
+])
+def test_invalid_jobs(server, body):
+    response = requests.post(f"{server.url}/jobs", data=body)
+    assert response.status_code == 400
+    assert 'error' in response.json()
+
+
+def test_job_rejection_reasons(image_server):
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, n_workers=2,
+                                 min_wait=0, max_wait=0, min_size=100)
+    scheduler = Scheduler(downloader)
+
+    urls = [f"{image_server}/200x200.jpg", f"{image_server}/16x16.jpg"]
+    job = scheduler.submit(urls)
+    while job.finished is None:
+        time.sleep(0.05)
+    info = job.as_dict()
+    assert (info['failed'], info['rejected']) == (1, 1)
+    assert list(info['reasons']) == [urls[1]]
+    assert "smaller than 100x100" in info['reasons'][urls[1]]
+
+    scheduler.stop()
+    downloader.close()
+    store_path.cleanup()
+
+
+def test_invalid_urls_fail_without_killing_workers(image_server):
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, n_workers=2, min_wait=0, max_wait=0)
+    scheduler = Scheduler(downloader)
+
+    bad = scheduler.submit([1, None, 'http://[invalid/a.jpg'])
+    assert bad.as_dict()['status'] == 'done'
+    assert (bad.n_done, bad.n_fail) == (3, 3)
+
+    job = scheduler.submit([f"{image_server}/{width}x100.jpg" for width in range(100, 104)])
+    while job.finished is None:
+        time.sleep(0.05)
+    assert job.n_fail == 0
+    assert all(worker.is_alive() for worker in scheduler._workers)
+
+    scheduler.stop()
+    downloader.close()
+    store_path.cleanup()
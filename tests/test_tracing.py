@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from requests.adapters import HTTPAdapter
+
+from imgdl.cli import main
+from imgdl.downloader import ImageDownloader
+from imgdl.tracing import SamplingProfiler, Tracer
+
+
+def test_trace_spans(image_server):
+    store_path = TemporaryDirectory()
+    tracer = Tracer()
+    downloader = ImageDownloader(store_path=store_path.name, n_workers=2, tracer=tracer)
+
+    urls = [f"{image_server}/{width}x100.jpg" for width in range(100, 104)]
+    downloader(urls)
+
+    trace = tracer.to_chrome()
+    spans = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+    for url in urls:
+        names = {span['name'] for span in spans if span['args'].get('url') == url}
+        assert {'queue wait', 'download', 'session', 'request', 'ttfb', 'body',
+                'decode', 'convert', 'write', 'politeness sleep'} <= names
+    n_connects = sum(span['name'] == 'connect' for span in spans)
+    assert 1 <= n_connects <= 2, "Connections should be traced, and reused by each thread"
+
+    threads = {event['tid'] for event in trace['traceEvents'] if event['ph'] == 'M'}
+    assert {span['tid'] for span in spans} == threads
+
+    store_path.cleanup()
+
+
+def test_cli_trace_and_profile(image_server):
+    store_path = TemporaryDirectory()
+    urls_file = Path(store_path.name, 'urls.txt')
+    urls_file.write_text("\n".join(f"{image_server}/{width}x100.jpg" for width in range(100, 120)))
+    trace_file = Path(store_path.name, 'trace.json')
+    profile_file = Path(store_path.name, 'profile.txt')
+
+    main([str(urls_file), '-o', store_path.name, '--trace', str(trace_file),
+          '--profile', str(profile_file)])
+
+    events = json.loads(trace_file.read_text())['traceEvents']
+    assert sum(event['name'] == 'download' for event in events) == 20
+    for line in profile_file.read_text().splitlines():
+        stack, count = line.rsplit(' ', 1)
+        assert stack.split(';')[0].startswith(('cli.py', 'downloader.py'))
+
+    store_path.cleanup()
+
+
+def test_sampling_profiler_focus():
+    with SamplingProfiler(interval=0.001) as profiler:
+        sum(i * i for i in range(10 ** 6))
+    assert profiler.n_samples > 0
+    assert not profiler.stacks, "Stacks outside of imgdl should be left out"
+
+
+def test_queue_wait_starts_when_queued(image_server):
+    store_path = TemporaryDirectory()
+    tracer = Tracer()
+    downloader = ImageDownloader(store_path=store_path.name, n_workers=1,
+                                 min_wait=0.2, max_wait=0.2, tracer=tracer)
+
+    urls = [f"{image_server}/{width}x100.jpg" for width in range(100, 104)]
+    downloader(urls)
+
+    waits = {event['args']['url']: event['dur'] / 1e6 for event in tracer.events
+             if event['name'] == 'queue wait'}
+    assert waits[urls[-1]] > 0.5, "Queue wait should include the time spent behind other urls"
+
+    store_path.cleanup()
+
+
+def test_no_tracing_adapter_without_tracer(image_server):
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, min_wait=0, max_wait=0)
+    downloader([f"{image_server}/100x100.jpg"])
+
+    for session in downloader.get_transport()._sessions:
+        assert type(session.get_adapter(image_server)) is HTTPAdapter
+
+    downloader.close()
+    store_path.cleanup()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from functools import partial
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from imgdl.downloader import ImageDownloader
+from imgdl.transport import Http2Transport, RequestsTransport
+
+pytest.importorskip('httpx')
+pytest.importorskip('h2')
+
+
+def test_http2_multiplexing(h2_image_server):
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(
+        store_path=store_path.name,
+        n_workers=8,
+        transport=partial(Http2Transport, prior_knowledge=True),
+    )
+
+    urls = [f"{h2_image_server}/{width}x100.jpg" for width in range(100, 130)]
+    paths = downloader(urls)
+    downloader.close()
+
+    assert all(Path(path).exists() for path in paths)
+    assert len(h2_image_server.requests) == 30
+    assert h2_image_server.server.connections == 1, \
+        "Concurrent downloads should be multiplexed on a single connection"
+
+    store_path.cleanup()
+
+
+def test_http2_falls_back_to_http1(image_server):
+    store_path = TemporaryDirectory()
+    downloader = ImageDownloader(store_path=store_path.name, transport='http2')
+    assert downloader.make_transport is Http2Transport
+
+    path = downloader._download_image(f"{image_server}/100x100.jpg")
+    assert Path(path).exists()
+    response = downloader.get_transport().get(f"{image_server}/100x100.jpg")
+    assert response.http_version == 'HTTP/1.1'
+    response.close()
+    downloader.close()
+
+    store_path.cleanup()
+
+
+def test_http2_headers():
+    transport = Http2Transport(
+        proxies={'http': 'http://proxy.provider.com:4015', 'https': 'http://proxy.provider.com:4015'},
+        headers={'User-Agent': 'robot', 'Connection': 'keep-alive'},
+    )
+    assert transport.headers == {'User-Agent': 'robot'}, \
+        "Connection specific headers are forbidden on HTTP/2"
+    assert transport.proxy == 'http://proxy.provider.com:4015'
+    transport.close()
+
+
+def test_default_transport():
+    downloader = ImageDownloader()
+    assert downloader.make_transport is RequestsTransport
+    with pytest.raises(ValueError):
+        ImageDownloader(transport='spdy')